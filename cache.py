@@ -0,0 +1,80 @@
+"""Small in-process caches shared by the cogs."""
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Mapping bounded by entry count and idle time
+
+    The least recently used entry is evicted once `max_entries` is reached and
+    entries not touched for `ttl` seconds expire. Hits, misses and evictions
+    are counted so the cache can be monitored.
+    """
+
+    def __init__(self, max_entries=1000, ttl=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()  # key -> (value, last access time)
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def get(self, key, default=None):
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return default
+        value, last_access = entry
+        now = time.monotonic()
+        if self.ttl is not None and now - last_access > self.ttl:
+            del self.entries[key]
+            self.expirations += 1
+            self.misses += 1
+            return default
+        self.entries[key] = (value, now)
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(self, key, value):
+        self.entries[key] = (value, time.monotonic())
+        self.entries.move_to_end(key)
+        self.evict_expired()
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key, default=None):
+        entry = self.entries.pop(key, None)
+        return entry[0] if entry else default
+
+    def evict_expired(self):
+        """Drop idle entries; the oldest entries sit at the front"""
+        if self.ttl is None:
+            return
+        cutoff = time.monotonic() - self.ttl
+        while self.entries:
+            key, (_, last_access) = next(iter(self.entries.items()))
+            if last_access > cutoff:
+                break
+            del self.entries[key]
+            self.expirations += 1
+
+    def clear(self):
+        self.entries.clear()
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self.entries),
+            "max_entries": self.max_entries,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations
+        }
+
+    def __len__(self):
+        return len(self.entries)
@@ -1,13 +1,65 @@
 import discord
-from discord.ext import commands
+from discord.ext import commands, tasks
 import asyncio
-from pymongo import MongoClient
+import copy
+import hashlib
 import os
 import random
+import time
 import json
-from dotenv import load_dotenv
 from datetime import datetime
 from discord import ui
+from storage import open_store, close_store, diff_documents
+from llm_gateway import open_gateway, close_gateway
+
+# Number of game events kept in a game's history
+GAME_HISTORY_LIMIT = 20
+
+# Short labels used in the party prompt, with the character fields they list
+PARTY_FIELDS = (
+    ("sp", "spells", ("cantrips", "spells")),
+    ("sk", "skills", ("skills",)),
+    ("tr", "traits", ("traits",)),
+    ("eq", "equipment", ("equipment", "inventory"))
+)
+# Key for the labels, sent next to the party prompt
+PARTY_LEGEND = ", ".join(f"{label}={meaning}" for label, meaning, _ in PARTY_FIELDS)
+
+def party_fingerprint(game):
+    """Short hash of the game's characters, stored next to the cached party prompt"""
+    characters = json.dumps(game.get("characters") or {}, sort_keys=True, default=str)
+    return hashlib.sha1(characters.encode("utf-8")).hexdigest()[:16]
+
+def build_party_prompt(game):
+    """One line per character, e.g. "Aria: Elf Wizard; sp Shield, Sleep; sk Arcana"
+
+    Empty fields are left out so the fragment stays short.
+    """
+    lines = []
+    for pid in game.get("player_ids", []):
+        char = game.get("characters", {}).get(pid)
+        if not char:
+            continue
+        parts = [f"{char.get('name', 'Unknown')}: {char.get('race', 'Unknown')} {char.get('class', 'Unknown')}"]
+        for label, _, keys in PARTY_FIELDS:
+            values = [str(v) for key in keys for v in (char.get(key) or [])]
+            if values:
+                parts.append(f"{label} {', '.join(values)}")
+        lines.append("; ".join(parts))
+    return "\n".join(lines)
+
+# Character races mapped to their entry in character_data.RACES
+RACE_MAPPING = {
+    "Human": "Human",
+    "Elf": "Elf (High Elf)",
+    "Dwarf": "Dwarf (Mountain Dwarf)",
+    "Halfling": "Halfling (Lightfoot)",
+    "Gnome": "Gnome (Rock)",
+    "Dragonborn": "Dragonborn",
+    "Tiefling": "Tiefling",
+    "Half-Elf": "Half-Elf",
+    "Half-Orc": "Half-Orc"
+}
 
 class InventoryDropdown(ui.Select):
     def __init__(self, options, index):
@@ -98,88 +150,251 @@ class ConfirmButton(ui.Button):
         
         self.view.stop()
 
+class SetupProgress:
+    """Channel message showing which players have finished their campaign choices"""
+    
+    def __init__(self, player_ids):
+        self.pending = list(player_ids)
+        self.completed = []
+        self.failed = []
+        self.message = None
+        self.lock = asyncio.Lock()
+    
+    async def start(self, send):
+        self.message = await send(self.content())
+    
+    async def finish(self, player_id, completed):
+        self.pending.remove(player_id)
+        (self.completed if completed else self.failed).append(player_id)
+        # Players can finish at the same moment; keep the edits in order
+        async with self.lock:
+            try:
+                await self.message.edit(content=self.content())
+            except discord.HTTPException as e:
+                # The tracker is cosmetic; a failed edit must not fail the setup
+                print(f"Error updating setup progress: {e}")
+    
+    def content(self):
+        total = len(self.pending) + len(self.completed) + len(self.failed)
+        lines = [f"📋 Character choices: {len(self.completed)}/{total} players done"]
+        if self.pending:
+            lines.append("Waiting on: " + ", ".join(f"<@{pid}>" for pid in self.pending))
+        if self.failed:
+            lines.append("Not finished: " + ", ".join(f"<@{pid}>" for pid in self.failed))
+        return "\n".join(lines)
+
 class DnDGame(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         
-        load_dotenv()
-        mongo_uri = os.getenv('MONGO_URI')
+        # Games live in the storage layer shared with GeminiChat
+        self.store = open_store()
         
-        if not mongo_uri:
-            print("WARNING: MONGO_URI not found in .env file!")
-            self.use_mongo = False
-            self.active_games = {}
-        else:
-            try:
-                self.mongo_client = MongoClient(mongo_uri)
-                self.db = self.mongo_client['emo_bot']
-                self.games_collection = self.db['dnd_games']
-                self.games_collection.create_index("channel_id", unique=True)
-                self.use_mongo = True
-                print("Successfully connected to MongoDB for DnD games")
-            except Exception as e:
-                print(f"Failed to connect to MongoDB: {e}")
-                self.use_mongo = False
-                self.active_games = {}
-                
-        self.gemini_model = None
+        # Write-behind cache: saves only touch memory and mark the game dirty,
+        # dirty games are flushed to the store every GAME_FLUSH_INTERVAL seconds
+        self.game_cache = {}
+        self.dirty_games = set()
+        # Last persisted copy of each cached game, used to send only changed fields
+        self.persisted_games = {}
+        self.flush_lock = asyncio.Lock()
+        self.channel_index = {}  # IC channel / OOC thread ID -> game channel ID
+        # Clean games unused for GAME_CACHE_TTL seconds are dropped after a flush
+        self.game_cache_ttl = float(os.getenv('GAME_CACHE_TTL', 1800))
+        self.game_last_used = {}  # game channel ID -> time.monotonic() of last use
+        # IC channels of started AI-GM games, so EmoNarration can ignore other messages cheaply
+        self.ai_ic_channels = set()
+        self.flush_games.change_interval(seconds=float(os.getenv('GAME_FLUSH_INTERVAL', 5)))
+        # Narration turns stored with each game for Emo's memory of the story
+        self.narration_max_turns = int(os.getenv('NARRATION_HISTORY_MAX_TURNS', 30))
+        self.gemini_chat = None
+        self.gateway = open_gateway()
+    
+    async def cog_load(self):
+        try:
+            # Connecting and migrating run on the storage executor, off the loop
+            await self.store.connect()
+            self.ai_ic_channels.update(await self.store.find_ai_gm_channels())
+        except Exception as e:
+            print(f"Error loading AI-GM channels: {e}")
+        self.flush_games.start()
     
     async def setup_gemini_model(self):
-        if not self.gemini_model:
+        if not self.gemini_chat:
             gemini_cog = self.bot.get_cog('GeminiChat')
             if gemini_cog and hasattr(gemini_cog, 'model'):
-                self.gemini_model = gemini_cog.model
+                self.gemini_chat = gemini_cog
                 print("Successfully connected to Gemini model for DnD features")
             else:
                 print("WARNING: GeminiChat cog not found or has no 'model' attribute.")
     
-    async def get_gemini_response(self, system_prompt, user_prompt, history=None):
+    async def get_gemini_response(self, system_prompt, user_prompt, history=None, guild_id=None):
         await self.setup_gemini_model()
-        if not self.gemini_model:
+        if not self.gemini_chat:
             return "Sorry, my storytelling brain isn't working right now. Check if GeminiChat is set up correctly!"
         
         try:
-            chat = self.gemini_model.start_chat(history=[])
-            await asyncio.to_thread(chat.send_message, system_prompt)
-            response = await asyncio.to_thread(chat.send_message, user_prompt)
+            # The system prompt is model configuration, so this is a single call
+            model = self.gemini_chat.get_model(system_prompt)
+            chat = model.start_chat(history=history or [])
+            response = await self.gateway.submit(chat.send_message, user_prompt, guild_id=guild_id)
             return response.text
         except Exception as e:
             print(f"Error getting Gemini response: {e}")
             return "Sorry, I tripped over my own code. Try again!"
 
     async def get_game(self, channel_id):
-        if not self.use_mongo:
-            return self.active_games.get(str(channel_id))
-        else:
-            return self.games_collection.find_one({"channel_id": str(channel_id)})
+        channel_id = str(channel_id)
+        if channel_id not in self.game_cache:
+            game = await self.store.get_game(channel_id)
+            if not game:
+                return None
+            self._cache_game(channel_id, game)
+            self.persisted_games[channel_id] = copy.deepcopy(game)
+        self.game_last_used[channel_id] = time.monotonic()
+        return self.game_cache[channel_id]
     
     async def save_game(self, channel_id, game_data):
-        if not self.use_mongo:
-            self.active_games[str(channel_id)] = game_data
-        else:
-            self.games_collection.update_one(
-                {"channel_id": str(channel_id)},
-                {"$set": game_data},
-                upsert=True
-            )
+        channel_id = str(channel_id)
+        # The cached party prompt is only valid for the characters it was built from
+        if "party_prompt" in game_data and game_data.get("party_prompt_source") != party_fingerprint(game_data):
+            del game_data["party_prompt"]
+            game_data.pop("party_prompt_source", None)
+        self._cache_game(channel_id, game_data)
+        self.dirty_games.add(channel_id)
     
     async def delete_game(self, channel_id):
-        if not self.use_mongo:
-            if str(channel_id) in self.active_games:
-                del self.active_games[str(channel_id)]
-        else:
-            self.games_collection.delete_one({"channel_id": str(channel_id)})
+        channel_id = str(channel_id)
+        # Wait out a flush in progress so its write can't land after the delete
+        async with self.flush_lock:
+            game = self._uncache_game(channel_id)
+            if game:
+                self.ai_ic_channels.discard(game.get("ic_channel_id"))
+            self.dirty_games.discard(channel_id)
+            await self.store.delete_game(channel_id)
+    
+    async def find_game_by_any_channel(self, channel_id):
+        """Find the game whose IC channel or OOC thread is `channel_id`"""
+        channel_id = str(channel_id)
+        game_channel_id = self.channel_index.get(channel_id)
+        if game_channel_id in self.game_cache:
+            self.game_last_used[game_channel_id] = time.monotonic()
+            return self.game_cache[game_channel_id]
+        
+        game = await self.store.find_game_by_any_channel(channel_id)
+        if not game:
+            return None
+        # Prefer a cached copy so unflushed changes aren't lost
+        if game["channel_id"] not in self.game_cache:
+            self._cache_game(game["channel_id"], game)
+            self.persisted_games[game["channel_id"]] = copy.deepcopy(game)
+        return self.game_cache[game["channel_id"]]
+    
+    def _cache_game(self, channel_id, game):
+        self.game_cache[channel_id] = game
+        self.game_last_used[channel_id] = time.monotonic()
+        for key in ("ic_channel_id", "ooc_thread_id"):
+            if game.get(key):
+                self.channel_index[game[key]] = channel_id
+        if game.get("is_ai_gm") and game.get("ic_channel_id"):
+            self.ai_ic_channels.add(game["ic_channel_id"])
+    
+    def _uncache_game(self, channel_id):
+        """Drop a game and everything derived from it from memory; returns the game"""
+        game = self.game_cache.pop(channel_id, None)
+        self.persisted_games.pop(channel_id, None)
+        self.game_last_used.pop(channel_id, None)
+        if game:
+            for key in ("ic_channel_id", "ooc_thread_id"):
+                if self.channel_index.get(game.get(key)) == channel_id:
+                    del self.channel_index[game[key]]
+        return game
+    
+    async def flush_dirty_games(self):
+        """Write the changed fields of every dirty game to the store, then drop idle clean ones"""
+        async with self.flush_lock:
+            await self._flush_dirty_games()
+            cutoff = time.monotonic() - self.game_cache_ttl
+            idle = [channel_id for channel_id, used in self.game_last_used.items()
+                    if used < cutoff and channel_id not in self.dirty_games]
+            for channel_id in idle:
+                self._uncache_game(channel_id)
+    
+    async def _flush_dirty_games(self):
+        while self.dirty_games:
+            channel_id = self.dirty_games.pop()
+            game = self.game_cache.get(channel_id)
+            if game is None:
+                continue
+            # Persist a snapshot so the worker thread never sees a dict being mutated
+            snapshot = copy.deepcopy(game)
+            persisted = self.persisted_games.get(channel_id)
+            try:
+                if persisted is None:
+                    await self.store.save_game(channel_id, snapshot)
+                else:
+                    set_fields, unset_fields, push_fields = diff_documents(persisted, snapshot)
+                    if set_fields or unset_fields or push_fields:
+                        await self.store.update_game_fields(channel_id, set_fields, unset_fields, push_fields)
+                self.persisted_games[channel_id] = snapshot
+            except Exception as e:
+                print(f"Error flushing game {channel_id}: {e}")
+                self.dirty_games.add(channel_id)
+                break
+    
+    @tasks.loop(seconds=5)
+    async def flush_games(self):
+        await self.flush_dirty_games()
+    
+    async def get_party_prompt(self, game):
+        """Compact description of the party for narration prompts, cached on the game"""
+        channel_id = game["channel_id"]
+        fingerprint = party_fingerprint(game)
+        if "party_prompt" not in game or game.get("party_prompt_source") != fingerprint:
+            game["party_prompt"] = build_party_prompt(game)
+            game["party_prompt_source"] = fingerprint
+            await self.save_game(channel_id, game)
+        return game["party_prompt"]
     
     async def add_to_game_history(self, channel_id, entry):
+        await self._append_capped(channel_id, "history", [entry], GAME_HISTORY_LIMIT)
+    
+    async def add_narration_turn(self, channel_id, user_prompt, narration):
+        """Persist one numbered narration exchange, keeping the last `narration_max_turns`"""
+        game = await self.get_game(channel_id)
+        if not game:
+            return None
+        turn = game.get("narration_turns", 0) + 1
+        game["narration_turns"] = turn
+        await self.save_game(channel_id, game)
+        await self._append_capped(channel_id, "narration_history", [
+            {"role": "user", "content": user_prompt, "turn": turn},
+            {"role": "model", "content": narration, "turn": turn}
+        ], self.narration_max_turns * 2)
+        return turn
+    
+    async def save_story_memory(self, channel_id, story_memory):
         game = await self.get_game(channel_id)
         if game:
-            if "history" not in game:
-                game["history"] = []
-            game["history"].append(entry)
-            if len(game["history"]) > 20:
-                game["history"] = game["history"][-20:]
+            game["story_memory"] = story_memory
             await self.save_game(channel_id, game)
     
+    async def _append_capped(self, channel_id, field, entries, limit):
+        channel_id = str(channel_id)
+        game = await self.get_game(channel_id)
+        if not game:
+            return
+        # The cached list and its persisted copy change together under the
+        # flush lock, so a running flush can never diff in these entries too
+        async with self.flush_lock:
+            game[field] = (list(game.get(field) or []) + entries)[-limit:]
+            if channel_id not in self.persisted_games:
+                # Not in the store yet, the next flush writes the whole game
+                self.dirty_games.add(channel_id)
+                return
+            # One small capped append on the server instead of rewriting the game
+            await self.store.append_to_game_list(channel_id, field, entries, limit)
+            self.persisted_games[channel_id][field] = copy.deepcopy(game[field])
+    
     @commands.command(name="dnd")
     async def dnd_setup(self, ctx):
         channel_id = str(ctx.channel.id)
@@ -315,11 +530,9 @@ class DnDGame(commands.Cog):
             ic_channel_id = str(ctx.channel.parent_id)
             
             # Find the game where this thread is the OOC thread
-            game = None
-            for stored_game in (self.active_games.values() if not self.use_mongo else self.games_collection.find()):
-                if stored_game.get("ooc_thread_id") == thread_id and stored_game.get("ic_channel_id") == ic_channel_id:
-                    game = stored_game
-                    break
+            game = await self.find_game_by_any_channel(thread_id)
+            if game and (game.get("ooc_thread_id") != thread_id or game.get("ic_channel_id") != ic_channel_id):
+                game = None
             
             if not game:
                 await ctx.send("No active D&D game found associated with this thread.")
@@ -433,221 +646,233 @@ class DnDGame(commands.Cog):
             await ctx.send(welcome_msg)
             await ctx.send(followup_msg)
             
-            from character_data import RACES, CLASSES
+            # Every player's DM flow runs at once, so setup takes as long as the
+            # slowest player rather than the sum of all of them
+            tracker = SetupProgress(game["player_ids"])
+            await tracker.start(ctx.send)
+            results = await asyncio.gather(
+                *(self._run_player_choices(ctx, channel_id, game, player_id, theme, tracker)
+                  for player_id in game["player_ids"]),
+                return_exceptions=True
+            )
             
-            race_mapping = {
-                "Human": "Human",
-                "Elf": "Elf (High Elf)",
-                "Dwarf": "Dwarf (Mountain Dwarf)",
-                "Halfling": "Halfling (Lightfoot)",
-                "Gnome": "Gnome (Rock)",
-                "Dragonborn": "Dragonborn",
-                "Tiefling": "Tiefling",
-                "Half-Elf": "Half-Elf",
-                "Half-Orc": "Half-Orc"
-            }
+            # A player whose flow raised counts as not finished
+            if all(result is True for result in results):
+                await ctx.send("Now players use `!start` to begin this adventure!")
+                # Characters are final, so Emo can start writing the opening scene
+                narration = self.bot.get_cog('EmoNarration')
+                if narration:
+                    narration.schedule_opening_scene(channel_id, guild_id=ctx.guild.id)
             
-            completed_players = set()
+            await self.add_to_game_history(channel_id, {
+                "event": "campaign_theme_set",
+                "theme": theme,
+                "timestamp": datetime.now().isoformat()
+            })
             
-            for player_id in game["player_ids"]:
-                player = self.bot.get_user(int(player_id))
-                if not player:
-                    await ctx.send(f"Error: Could not find user <@{player_id}>.")
-                    continue
-                
-                character = game["characters"][player_id]
-                race_key = race_mapping.get(character["race"].split()[0], character["race"])
-                if race_key not in RACES:
-                    await ctx.send(f"Error: Invalid race '{character['race']}' for <@{player_id}>.")
-                    continue
-                
-                race_data = RACES[race_key]
-                class_data = CLASSES[character["class"]]
+        except asyncio.TimeoutError:
+            await ctx.send("Campaign setup timed out. Please try again when you're ready.")
+    
+    async def _run_player_choices(self, ctx, channel_id, game, player_id, theme, tracker):
+        try:
+            completed = await self.player_choices(ctx, channel_id, game, player_id, theme)
+        except Exception as e:
+            print(f"Error in campaign setup for player {player_id}: {e}")
+            await ctx.send(f"Something went wrong while sending <@{player_id}> their character choices.")
+            completed = False
+        await tracker.finish(player_id, completed)
+        return completed
+    
+    async def player_choices(self, ctx, channel_id, game, player_id, theme):
+        """DM one player their equipment, skill and spell choices; True once they are saved"""
+        from character_data import RACES, CLASSES
         
-                character["languages"] = race_data["languages"]
-                character["traits"] = race_data["traits"]
-                character["class_features"] = class_data["class_features"]
-                
-                # Initial embed with consolidated fields
-                intro_msg = (
-                    f"Hail, noble adventurer! Here are some special choices for your character, "
-                    f"{character['name']}, to prepare for the {theme} adventure!"
+        player = self.bot.get_user(int(player_id))
+        if not player:
+            await ctx.send(f"Error: Could not find user <@{player_id}>.")
+            return False
+        
+        character = game["characters"][player_id]
+        race_key = RACE_MAPPING.get(character["race"].split()[0], character["race"])
+        if race_key not in RACES:
+            await ctx.send(f"Error: Invalid race '{character['race']}' for <@{player_id}>.")
+            return False
+        
+        race_data = RACES[race_key]
+        class_data = CLASSES[character["class"]]
+
+        character["languages"] = race_data["languages"]
+        character["traits"] = race_data["traits"]
+        character["class_features"] = class_data["class_features"]
+        
+        # Initial embed with consolidated fields
+        intro_msg = (
+            f"Hail, noble adventurer! Here are some special choices for your character, "
+            f"{character['name']}, to prepare for the {theme} adventure!"
+        )
+        char_embed = discord.Embed(
+            title=f"Character: {character['name']}",
+            description=f"A {character['race']} {character['class']}",
+            color=discord.Color.gold()
+        )
+        char_embed.add_field(name="Languages", value=", ".join(race_data["languages"]), inline=True)
+        
+        # Consolidate traits and class features
+        traits_and_features = f"**Traits:** {', '.join(race_data['traits'])}\n**Class Features:** {', '.join(class_data['class_features'])}"
+        char_embed.add_field(name="Traits & Features", value=traits_and_features, inline=False)
+        
+        ability_scores = (
+            f"STR: {character.get('strength', '10')} | "
+            f"DEX: {character.get('dexterity', '10')} | "
+            f"CON: {character.get('constitution', '10')}\n"
+            f"INT: {character.get('intelligence', '10')} | "
+            f"WIS: {character.get('wisdom', '10')} | "
+            f"CHA: {character.get('charisma', '10')}"
+        )
+        char_embed.add_field(name="Ability Scores", value=ability_scores, inline=False)
+        
+        # Split inventory into fixed and choosable
+        inventory_options = class_data["equipment"]
+        fixed_items = [item.strip() for item in inventory_options if " OR " not in item]
+        choosable_pairs = [item.strip() for item in inventory_options if " OR " in item]
+        char_embed.add_field(name="Inventory", value=", ".join(fixed_items) or "None yet", inline=True)
+        
+        # Handle choosable inventory
+        if choosable_pairs:
+            char_embed.add_field(
+                name="Choosable Equipment",
+                value=", ".join(choosable_pairs) + "\n**Choose one from each**",
+                inline=False
+            )
+            view = SelectionView(player_id, len(choosable_pairs), selection_type="inventory")
+            for i, pair in enumerate(choosable_pairs):
+                options = [opt.strip() for opt in pair.split(" OR ")]
+                view.add_item(InventoryDropdown(options, i))
+            view.add_item(ConfirmButton())
+            await player.send(intro_msg, embed=char_embed, view=view)
+            await view.wait()
+            selected_inventory = fixed_items.copy()
+            chosen_items = []
+            for i, pair in enumerate(choosable_pairs):
+                options = [opt.strip() for opt in pair.split(" OR ")]
+                chosen = view.selected_inventory[i]
+                if chosen is None:
+                    chosen = options[0]
+                chosen_items.append(chosen)
+                selected_inventory.append(chosen)
+            character["inventory"] = selected_inventory
+            for idx, field in enumerate(char_embed.fields):
+                if field.name == "Inventory":
+                    char_embed.set_field_at(
+                        idx,
+                        name="Inventory",
+                        value=", ".join(selected_inventory),
+                        inline=True
+                    )
+                    break
+            for idx, field in enumerate(char_embed.fields):
+                if field.name == "Choosable Equipment":
+                    char_embed.remove_field(idx)
+                    break
+            char_embed.add_field(
+                name="Chosen Equipment",
+                value="Your chosen items are locked: " + ", ".join(chosen_items),
+                inline=False
+            )
+            intro_msg = f"Your inventory for {character['name']} is set!"
+            await player.send(intro_msg, embed=char_embed)
+        else:
+            character["inventory"] = fixed_items
+        
+        # Handle skills in a new embed
+        if "skills" in class_data and class_data["skills"]["choose"] > 0:
+            skills_embed = discord.Embed(
+                title=f"Skills for {character['name']}",
+                description=f"Choose your skills for the {theme} adventure!",
+                color=discord.Color.gold()
+            )
+            skills_embed.add_field(
+                name=f"Skills (Choose {class_data['skills']['choose']})",
+                value=", ".join(class_data["skills"]["options"]),
+                inline=False
+            )
+            view = SelectionView(player_id, 0, selection_type="skills", choose_count=class_data["skills"]["choose"])
+            view.add_item(SkillsDropdown(class_data["skills"]["options"], class_data["skills"]["choose"]))
+            view.add_item(ConfirmButton())
+            await player.send(intro_msg, embed=skills_embed, view=view)
+            await view.wait()
+            if view.selected_skills:
+                skills_embed.set_field_at(
+                    0,
+                    name="Skills",
+                    value=", ".join(view.selected_skills),
+                    inline=False
                 )
-                char_embed = discord.Embed(
-                    title=f"Character: {character['name']}",
-                    description=f"A {character['race']} {character['class']}",
+                character["skills"] = view.selected_skills
+            intro_msg = f"Your skills for {character['name']} are set!"
+            await player.send(intro_msg, embed=skills_embed)
+        
+        # Handle spells in separate embeds
+        if "spells" in class_data:
+            if "choose_cantrips" in class_data["spells"]:
+                cantrips_embed = discord.Embed(
+                    title=f"Cantrips for {character['name']}",
+                    description=f"Choose your cantrips for the {theme} adventure!",
                     color=discord.Color.gold()
                 )
-                char_embed.add_field(name="Languages", value=", ".join(race_data["languages"]), inline=True)
-                
-                # Consolidate traits and class features
-                traits_and_features = f"**Traits:** {', '.join(race_data['traits'])}\n**Class Features:** {', '.join(class_data['class_features'])}"
-                char_embed.add_field(name="Traits & Features", value=traits_and_features, inline=False)
-                
-                ability_scores = (
-                    f"STR: {character.get('strength', '10')} | "
-                    f"DEX: {character.get('dexterity', '10')} | "
-                    f"CON: {character.get('constitution', '10')}\n"
-                    f"INT: {character.get('intelligence', '10')} | "
-                    f"WIS: {character.get('wisdom', '10')} | "
-                    f"CHA: {character.get('charisma', '10')}"
+                cantrips_embed.add_field(
+                    name=f"Cantrips (Choose {class_data['spells']['choose_cantrips']})",
+                    value=", ".join(class_data["spells"]["cantrips"]),
+                    inline=False
                 )
-                char_embed.add_field(name="Ability Scores", value=ability_scores, inline=False)
-                
-                # Split inventory into fixed and choosable
-                inventory_options = class_data["equipment"]
-                fixed_items = [item.strip() for item in inventory_options if " OR " not in item]
-                choosable_pairs = [item.strip() for item in inventory_options if " OR " in item]
-                char_embed.add_field(name="Inventory", value=", ".join(fixed_items) or "None yet", inline=True)
-                
-                # Handle choosable inventory
-                if choosable_pairs:
-                    char_embed.add_field(
-                        name="Choosable Equipment",
-                        value=", ".join(choosable_pairs) + "\n**Choose one from each**",
+                view = SelectionView(player_id, 0, selection_type="cantrips", choose_count=class_data["spells"]["choose_cantrips"])
+                view.add_item(SpellsDropdown("Cantrip", class_data["spells"]["cantrips"], class_data["spells"]["choose_cantrips"]))
+                view.add_item(ConfirmButton())
+                await player.send(intro_msg, embed=cantrips_embed, view=view)
+                await view.wait()
+                if view.selected_cantrips:
+                    cantrips_embed.set_field_at(
+                        0,
+                        name="Cantrips",
+                        value=", ".join(view.selected_cantrips),
                         inline=False
                     )
-                    view = SelectionView(player_id, len(choosable_pairs), selection_type="inventory")
-                    for i, pair in enumerate(choosable_pairs):
-                        options = [opt.strip() for opt in pair.split(" OR ")]
-                        view.add_item(InventoryDropdown(options, i))
-                    view.add_item(ConfirmButton())
-                    await player.send(intro_msg, embed=char_embed, view=view)
-                    await view.wait()
-                    selected_inventory = fixed_items.copy()
-                    chosen_items = []
-                    for i, pair in enumerate(choosable_pairs):
-                        options = [opt.strip() for opt in pair.split(" OR ")]
-                        chosen = view.selected_inventory[i]
-                        if chosen is None:
-                            chosen = options[0]
-                        chosen_items.append(chosen)
-                        selected_inventory.append(chosen)
-                    character["inventory"] = selected_inventory
-                    for idx, field in enumerate(char_embed.fields):
-                        if field.name == "Inventory":
-                            char_embed.set_field_at(
-                                idx,
-                                name="Inventory",
-                                value=", ".join(selected_inventory),
-                                inline=True
-                            )
-                            break
-                    for idx, field in enumerate(char_embed.fields):
-                        if field.name == "Choosable Equipment":
-                            char_embed.remove_field(idx)
-                            break
-                    char_embed.add_field(
-                        name="Chosen Equipment",
-                        value="Your chosen items are locked: " + ", ".join(chosen_items),
-                        inline=False
-                    )
-                    intro_msg = f"Your inventory for {character['name']} is set!"
-                    await player.send(intro_msg, embed=char_embed)
-                else:
-                    character["inventory"] = fixed_items
-                
-                # Handle skills in a new embed
-                if "skills" in class_data and class_data["skills"]["choose"] > 0:
-                    skills_embed = discord.Embed(
-                        title=f"Skills for {character['name']}",
-                        description=f"Choose your skills for the {theme} adventure!",
-                        color=discord.Color.gold()
-                    )
-                    skills_embed.add_field(
-                        name=f"Skills (Choose {class_data['skills']['choose']})",
-                        value=", ".join(class_data["skills"]["options"]),
+                    character["cantrips"] = view.selected_cantrips
+                intro_msg = f"Your cantrips for {character['name']} are set!"
+                await player.send(intro_msg, embed=cantrips_embed)
+            
+            if "choose_spells" in class_data["spells"]:
+                spells_embed = discord.Embed(
+                    title=f"Spells for {character['name']}",
+                    description=f"Choose your spells for the {theme} adventure!",
+                    color=discord.Color.gold()
+                )
+                spells_embed.add_field(
+                    name=f"1st-Level Spells (Choose {class_data['spells']['choose_spells']})",
+                    value=", ".join(class_data["spells"]["spells"]),
+                    inline=False
+                )
+                view = SelectionView(player_id, 0, selection_type="spells", choose_count=class_data["spells"]["choose_spells"])
+                view.add_item(SpellsDropdown("Spell", class_data["spells"]["spells"], class_data["spells"]["choose_spells"]))
+                view.add_item(ConfirmButton())
+                await player.send(intro_msg, embed=spells_embed, view=view)
+                await view.wait()
+                if view.selected_spells:
+                    spells_embed.set_field_at(
+                        0,
+                        name="1st-Level Spells",
+                        value=", ".join(view.selected_spells),
                         inline=False
                     )
-                    view = SelectionView(player_id, 0, selection_type="skills", choose_count=class_data["skills"]["choose"])
-                    view.add_item(SkillsDropdown(class_data["skills"]["options"], class_data["skills"]["choose"]))
-                    view.add_item(ConfirmButton())
-                    await player.send(intro_msg, embed=skills_embed, view=view)
-                    await view.wait()
-                    if view.selected_skills:
-                        skills_embed.set_field_at(
-                            0,
-                            name="Skills",
-                            value=", ".join(view.selected_skills),
-                            inline=False
-                        )
-                        character["skills"] = view.selected_skills
-                    intro_msg = f"Your skills for {character['name']} are set!"
-                    await player.send(intro_msg, embed=skills_embed)
-                
-                # Handle spells in separate embeds
-                if "spells" in class_data:
-                    if "choose_cantrips" in class_data["spells"]:
-                        cantrips_embed = discord.Embed(
-                            title=f"Cantrips for {character['name']}",
-                            description=f"Choose your cantrips for the {theme} adventure!",
-                            color=discord.Color.gold()
-                        )
-                        cantrips_embed.add_field(
-                            name=f"Cantrips (Choose {class_data['spells']['choose_cantrips']})",
-                            value=", ".join(class_data["spells"]["cantrips"]),
-                            inline=False
-                        )
-                        view = SelectionView(player_id, 0, selection_type="cantrips", choose_count=class_data["spells"]["choose_cantrips"])
-                        view.add_item(SpellsDropdown("Cantrip", class_data["spells"]["cantrips"], class_data["spells"]["choose_cantrips"]))
-                        view.add_item(ConfirmButton())
-                        await player.send(intro_msg, embed=cantrips_embed, view=view)
-                        await view.wait()
-                        if view.selected_cantrips:
-                            cantrips_embed.set_field_at(
-                                0,
-                                name="Cantrips",
-                                value=", ".join(view.selected_cantrips),
-                                inline=False
-                            )
-                            character["cantrips"] = view.selected_cantrips
-                        intro_msg = f"Your cantrips for {character['name']} are set!"
-                        await player.send(intro_msg, embed=cantrips_embed)
-                    
-                    if "choose_spells" in class_data["spells"]:
-                        spells_embed = discord.Embed(
-                            title=f"Spells for {character['name']}",
-                            description=f"Choose your spells for the {theme} adventure!",
-                            color=discord.Color.gold()
-                        )
-                        spells_embed.add_field(
-                            name=f"1st-Level Spells (Choose {class_data['spells']['choose_spells']})",
-                            value=", ".join(class_data["spells"]["spells"]),
-                            inline=False
-                        )
-                        view = SelectionView(player_id, 0, selection_type="spells", choose_count=class_data["spells"]["choose_spells"])
-                        view.add_item(SpellsDropdown("Spell", class_data["spells"]["spells"], class_data["spells"]["choose_spells"]))
-                        view.add_item(ConfirmButton())
-                        await player.send(intro_msg, embed=spells_embed, view=view)
-                        await view.wait()
-                        if view.selected_spells:
-                            spells_embed.set_field_at(
-                                0,
-                                name="1st-Level Spells",
-                                value=", ".join(view.selected_spells),
-                                inline=False
-                            )
-                            character["spells"] = view.selected_spells
-                        intro_msg = f"Your spells for {character['name']} are set!"
-                        await player.send(intro_msg, embed=spells_embed)
-                
-                game["characters"][player_id] = character
-                await self.save_game(channel_id, game)
-                await player.send(intro_msg, embed=char_embed)
-                await ctx.send(f"Player <@{player_id}> completed the special choices for their character.")
-                completed_players.add(player_id)
-            
-            if len(completed_players) == len(game["player_ids"]):
-                await ctx.send("Now players use `!start` to begin this adventure!")
-            
-            await self.add_to_game_history(channel_id, {
-                "event": "campaign_theme_set",
-                "theme": theme,
-                "timestamp": datetime.now().isoformat()
-            })
-            
-        except asyncio.TimeoutError:
-            await ctx.send("Campaign setup timed out. Please try again when you're ready.")
+                    character["spells"] = view.selected_spells
+                intro_msg = f"Your spells for {character['name']} are set!"
+                await player.send(intro_msg, embed=spells_embed)
+        
+        # Saved as soon as this player is done, independent of the others
+        game["characters"][player_id] = character
+        await self.save_game(channel_id, game)
+        await player.send(intro_msg, embed=char_embed)
+        return True
     
     @commands.command(name="start")
     async def start_game(self, ctx):
@@ -732,12 +957,9 @@ class DnDGame(commands.Cog):
         parent_channel_id = str(ctx.channel.parent_id) if isinstance(ctx.channel, discord.Thread) else None
         
         # Find the game where this is the OOC thread or IC channel
-        game = None
-        for stored_game in (self.active_games.values() if not self.use_mongo else self.games_collection.find()):
-            if (stored_game.get("ooc_thread_id") == channel_id or
-                (parent_channel_id and stored_game.get("ic_channel_id") == parent_channel_id)):
-                game = stored_game
-                break
+        game = await self.find_game_by_any_channel(channel_id)
+        if not game and parent_channel_id:
+            game = await self.find_game_by_any_channel(parent_channel_id)
         
         if not game:
             await ctx.send("There is no active D&D game associated with this channel or thread.")
@@ -810,9 +1032,11 @@ class DnDGame(commands.Cog):
         
         await ctx.send(embed=embed)
 
-    def cog_unload(self):
-        if self.use_mongo:
-            self.mongo_client.close()
+    async def cog_unload(self):
+        self.flush_games.cancel()
+        await self.flush_dirty_games()
+        close_store()
+        close_gateway()
 
 async def setup(bot):
     await bot.add_cog(DnDGame(bot))
\ No newline at end of file
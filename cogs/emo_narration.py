@@ -1,12 +1,57 @@
 import discord
 from discord.ext import commands
 import asyncio
+import hashlib
+import os
+from streaming import StreamingMessage, stream_chunks
+from llm_gateway import open_gateway, close_gateway
+from story_memory import StoryMemory
+from cache import LRUCache
+from cogs.dnd_game import PARTY_LEGEND
+
+# Sent as the model's system instruction for every narration turn
+DM_SYSTEM_PROMPT = "You are Emo, a Dungeon Master for a DnD adventure. Narrate in third-person perspective (e.g., 'Mira tries to reach out'), using simple, clear language. Describe scenes and actions directly, explain dice rolls clearly (e.g., 'roll a d20 and add Persuasion bonus'), and weave in character details (race, class, skills, traits, equipment). Respond to player choices with checks when needed, and keep responses short (up to 7 lines)."
 
 class EmoNarration(commands.Cog):
     def __init__(self, bot):
         self.bot = bot
         self.gemini_chat = None
-        self.game_histories = {}  # Store chat history per IC channel
+        self.gateway = open_gateway()
+        # Narration history lives with the game; only this much of it is sent
+        self.history_max_tokens = int(os.getenv('NARRATION_HISTORY_MAX_TOKENS', 6000))
+        # Turns sent verbatim; older ones are folded into the story memory in
+        # the background once this many extra turns have piled up
+        self.recent_turns = int(os.getenv('NARRATION_RECENT_TURNS', 6))
+        self.compaction_batch_turns = int(os.getenv('STORY_COMPACTION_BATCH_TURNS', 4))
+        # Compaction can only summarize turns still kept with the game, so the
+        # recent window plus one batch has to fit in the stored history
+        history_turns = int(os.getenv('NARRATION_HISTORY_MAX_TURNS', 30))
+        if self.recent_turns + self.compaction_batch_turns >= history_turns:
+            self.recent_turns = max(1, min(self.recent_turns, history_turns // 2))
+            self.compaction_batch_turns = max(1, history_turns - self.recent_turns - 1)
+            print(f"WARNING: NARRATION_RECENT_TURNS + STORY_COMPACTION_BATCH_TURNS must be below "
+                  f"NARRATION_HISTORY_MAX_TURNS; using {self.recent_turns} recent turns and "
+                  f"batches of {self.compaction_batch_turns}")
+        self.compacting = set()
+        self.background_tasks = set()
+        # Replies to Emo are collected per IC channel and narrated together once
+        # the window closes or every party member has acted
+        self.action_window = float(os.getenv('NARRATION_BATCH_WINDOW', 5))
+        self.pending_actions = {}  # IC channel ID -> {"messages": [...], "actors": set, "timer": task}
+        self.narration_locks = {}  # IC channel ID -> lock keeping narrations in order
+        # Opening scene being generated per IC channel; repeated !emo calls wait on it
+        self.opening_narrations = {}
+        # Opening scenes are written in the background once a campaign is set up
+        self.pregenerate_openings = os.getenv('PREGENERATE_OPENING_SCENE', 'true').lower() == 'true'
+        # IDs of Emo's recent messages in IC channels, for checking replies without a fetch
+        self.emo_message_ids = LRUCache(max_entries=1000)
+
+    async def cog_unload(self):
+        for batch in self.pending_actions.values():
+            if batch["timer"]:
+                batch["timer"].cancel()
+        self.pending_actions.clear()
+        close_gateway()
 
     async def setup_gemini_chat(self):
         if not self.gemini_chat:
@@ -16,36 +61,130 @@ class EmoNarration(commands.Cog):
             elif not hasattr(self.gemini_chat, 'model'):
                 print("WARNING: GeminiChat cog loaded but has no model attribute.")
 
-    async def get_gemini_response(self, system_prompt, user_prompt, ic_channel_id):
+    async def get_gemini_response(self, system_prompt, user_prompt, ic_channel_id, streamer=None,
+                                  guild_id=None, user_id=None):
+        """Get the next narration; with a `streamer` it is shown as it is generated"""
         await self.setup_gemini_chat()
         if not self.gemini_chat or not hasattr(self.gemini_chat, 'model') or not self.gemini_chat.model:
-            return "Sorry, my narration brain isn't working! Check if GEMINI_API_KEY is set in .env."
+            narration = "Sorry, my narration brain isn't working! Check if GEMINI_API_KEY is set in .env."
+            if streamer:
+                await streamer.finish(narration)
+            return narration
         try:
-            # Use existing history or start fresh
-            if ic_channel_id not in self.game_histories:
-                self.game_histories[ic_channel_id] = []
-            
-            # Convert history to Gemini format with roles
-            history = [{"role": "user" if i % 2 == 0 else "model", "parts": [{"text": entry["content"]}]}
-                      for i, entry in enumerate(self.game_histories[ic_channel_id])]
-            
-            chat = self.gemini_chat.model.start_chat(history=history)
+            # Narration history is loaded lazily with the game for this IC channel
+            dnd_game = self.bot.get_cog('DnDGame')
+            game = await dnd_game.find_game_by_any_channel(ic_channel_id) if dnd_game else None
+            # Turns already folded into the story memory are not resent
+            memory = StoryMemory.from_game(game) if game else StoryMemory()
+            entries = [entry for entry in ((game.get("narration_history") or []) if game else [])
+                       if entry.get("turn") is None or entry["turn"] > memory.through_turn]
+            history = self._bounded_history(entries)
+            story_context = memory.context_prompt()
+            if story_context:
+                history[:0] = [
+                    {"role": "user", "parts": [{"text": story_context}]},
+                    {"role": "model", "parts": [{"text": "Understood, I remember the story so far."}]}
+                ]
             
-            # Send system prompt first
-            await asyncio.to_thread(chat.send_message, {"role": "user", "parts": [{"text": system_prompt}]})
-            
-            # Then send the user prompt and get response
-            response = await asyncio.to_thread(chat.send_message, {"role": "user", "parts": [{"text": user_prompt}]})
-            narration = response.text
+            # The DM instructions are model configuration, so each turn is one call
+            chat = self.gemini_chat.get_model(system_prompt).start_chat(history=history)
+            message = {"role": "user", "parts": [{"text": user_prompt}]}
+            if streamer:
+                runner = self.gateway.runner(guild_id=guild_id, user_id=user_id)
+                async for chunk in stream_chunks(chat.send_message, message, runner=runner):
+                    await streamer.append(chunk)
+                narration = streamer.text
+                await streamer.finish()
+            else:
+                response = await self.gateway.submit(chat.send_message, message, guild_id=guild_id, user_id=user_id)
+                narration = response.text
             
             # Update history - add only the actual user prompt and model response
-            self.game_histories[ic_channel_id].append({"role": "user", "content": user_prompt})
-            self.game_histories[ic_channel_id].append({"role": "model", "content": narration})
+            if game:
+                await dnd_game.add_narration_turn(game["channel_id"], user_prompt, narration)
+                self._schedule_story_compaction(game["channel_id"])
             
             return narration
         except Exception as e:
             print(f"Error getting Gemini response: {e}")
-            return "Sorry, something went wrong with the narration!"
+            narration = "Sorry, something went wrong with the narration!"
+            if streamer:
+                await streamer.finish(narration)
+            return narration
+
+    def _schedule_story_compaction(self, game_channel_id):
+        """Fold old turns into the story memory in the background, off the reply path"""
+        if game_channel_id in self.compacting:
+            return
+        self.compacting.add(game_channel_id)
+        self._track(asyncio.create_task(self.compact_story(game_channel_id)))
+
+    async def compact_story(self, game_channel_id):
+        """Fold turns older than the recent window into the story summary and notes"""
+        try:
+            dnd_game = self.bot.get_cog('DnDGame')
+            game = await dnd_game.get_game(game_channel_id) if dnd_game else None
+            if not game:
+                return
+            memory = StoryMemory.from_game(game)
+            latest_turn = game.get("narration_turns", 0)
+            if latest_turn - memory.through_turn <= self.recent_turns + self.compaction_batch_turns:
+                return
+            
+            through_turn = latest_turn - self.recent_turns
+            turns = [entry for entry in game.get("narration_history") or []
+                     if memory.through_turn < entry.get("turn", 0) <= through_turn]
+            if not turns:
+                return
+            response = await self.gateway.submit(
+                self.gemini_chat.get_model().generate_content,
+                memory.compaction_prompt(turns)
+            )
+            # Only mark what was actually summarized; turns that already fell
+            # out of the stored history are skipped, never claimed
+            memory.apply_compaction(response.text, max(entry["turn"] for entry in turns))
+            await dnd_game.save_story_memory(game_channel_id, memory.to_dict())
+        except Exception as e:
+            print(f"Error compacting story for game {game_channel_id}: {e}")
+        finally:
+            self.compacting.discard(game_channel_id)
+
+    def _bounded_history(self, entries):
+        """Newest narration entries that fit the token budget, in Gemini format"""
+        history = []
+        token_budget = self.history_max_tokens
+        for entry in reversed(entries):
+            tokens = len(entry["content"]) // 4 + 1
+            if tokens > token_budget:
+                break
+            token_budget -= tokens
+            history.append({"role": entry["role"], "parts": [{"text": entry["content"]}]})
+        history.reverse()
+        # Gemini expects the history to open with a user turn
+        while history and history[0]["role"] != "user":
+            history.pop(0)
+        return history
+
+    async def narrate(self, user_prompt, ic_channel_id, reply, send, guild_id=None, user_id=None):
+        """Generate a narration and post it with `reply`, streaming when enabled
+        
+        Text that doesn't fit in one message continues through `send`.
+        """
+        await self.setup_gemini_chat()
+        if self.gemini_chat and getattr(self.gemini_chat, 'stream_responses', False):
+            streamer = StreamingMessage(
+                await reply("🎲 *Emo is weaving the tale...*"),
+                send,
+                self.gemini_chat._split_text,
+                edit_interval=self.gemini_chat.stream_edit_interval
+            )
+            return await self.get_gemini_response(DM_SYSTEM_PROMPT, user_prompt, ic_channel_id, streamer,
+                                                  guild_id=guild_id, user_id=user_id)
+        
+        narration = await self.get_gemini_response(DM_SYSTEM_PROMPT, user_prompt, ic_channel_id,
+                                                   guild_id=guild_id, user_id=user_id)
+        await reply(narration)
+        return narration
 
     @commands.command(name="emo")
     async def emo_narrate(self, ctx):
@@ -55,37 +194,82 @@ class EmoNarration(commands.Cog):
             return
 
         # Find the game associated with this channel as IC chat
-        game = None
-        for stored_game in (dnd_game.active_games.values() if not dnd_game.use_mongo else dnd_game.games_collection.find()):
-            if stored_game.get("ic_channel_id") == str(ctx.channel.id):
-                game = stored_game
-                break
+        game = await dnd_game.find_game_by_any_channel(ctx.channel.id)
+        if game and game.get("ic_channel_id") != str(ctx.channel.id):
+            game = None
 
         if not game or not game.get("is_ai_gm"):
             await ctx.send("This command only works in the IC chat with Emo as GM!")
             return
 
+        # Single flight: a second !emo while the scene is being written joins
+        # the first one instead of generating and posting another scene
+        channel_id = str(ctx.channel.id)
+        task = self.opening_narrations.get(channel_id)
+        if task is None:
+            task = asyncio.create_task(self.open_scene(ctx, dnd_game, game))
+            self.opening_narrations[channel_id] = task
+            task.add_done_callback(lambda _: self.opening_narrations.pop(channel_id, None))
+        await asyncio.shield(task)
+
+    async def open_scene(self, ctx, dnd_game, game):
+        """Post the opening narration for `game`, using the pre-generated scene if still valid"""
+        user_prompt, fingerprint = await self._opening_prompt(dnd_game, game)
+        channel_id = str(ctx.channel.id)
+        async with self.narration_locks.setdefault(channel_id, asyncio.Lock()):
+            cached = game.get("opening_scene")
+            if cached and cached.get("fingerprint") == fingerprint:
+                # Served once; a later !emo writes a fresh scene
+                del game["opening_scene"]
+                await dnd_game.save_game(game["channel_id"], game)
+                await self.setup_gemini_chat()
+                for chunk in self.gemini_chat._split_text(cached["text"]):
+                    await ctx.send(chunk)
+                await dnd_game.add_narration_turn(game["channel_id"], user_prompt, cached["text"])
+                return
+            async with ctx.typing():
+                await self.narrate(user_prompt, channel_id, ctx.send, ctx.send,
+                                   guild_id=ctx.guild.id, user_id=ctx.author.id)
+
+    async def _opening_prompt(self, dnd_game, game):
+        """Opening scene prompt plus a fingerprint of everything it depends on"""
         # Get player info, theme, and detailed character data
         players = ", ".join(game["players"])
         theme = game["theme"]
-        character_details = []
-        for pid in game["player_ids"]:
-            char = game["characters"][pid]
-            name = char.get("name", "Unknown")
-            race = char.get("race", "Unknown")
-            char_class = char.get("class", "Unknown")
-            spells = ", ".join(char.get("spells", [])) or "None"
-            skills = ", ".join(char.get("skills", [])) or "None"
-            traits = ", ".join(char.get("traits", [])) or "None"
-            equipment = ", ".join(char.get("equipment", [])) or "None"
-            character_details.append(f"{name} (Race: {race}, Class: {char_class}, Spells: {spells}, Skills: {skills}, Traits: {traits}, Equipment: {equipment})")
+        party = await dnd_game.get_party_prompt(game)
 
         # Generate narration with simpler style
-        system_prompt = "You are Emo, a Dungeon Master for a DnD adventure. Narrate in third-person perspective (e.g., 'Mira tries to reach out'), using simple, clear language. Describe scenes and actions directly, explain dice rolls clearly (e.g., 'roll a d20 and add Persuasion bonus'), and weave in character details (race, class, skills, traits, equipment). Respond to player choices with checks when needed, and keep responses short (up to 7 lines)."
-        user_prompt = f"Start a {theme} adventure for players {players} with characters: {'; '.join(character_details)}. Set the scene and begin the story."
-        async with ctx.typing():
-            narration = await self.get_gemini_response(system_prompt, user_prompt, str(ctx.channel.id))
-            await ctx.send(narration)
+        user_prompt = (f"Start a {theme} adventure for players {players}. Set the scene and begin the story.\n"
+                       f"Party ({PARTY_LEGEND}):\n{party}")
+        # A scene written before earlier narration turns would ignore them
+        key = f"{game.get('narration_turns', 0)}\n{user_prompt}"
+        return user_prompt, hashlib.sha1(key.encode()).hexdigest()
+
+    def schedule_opening_scene(self, game_channel_id, guild_id=None):
+        """Write the opening scene in the background so the first !emo can post it at once"""
+        if self.pregenerate_openings:
+            self._track(asyncio.create_task(self.pregenerate_opening_scene(game_channel_id, guild_id)))
+
+    async def pregenerate_opening_scene(self, game_channel_id, guild_id=None):
+        try:
+            await self.setup_gemini_chat()
+            dnd_game = self.bot.get_cog('DnDGame')
+            if not dnd_game or not self.gemini_chat or not getattr(self.gemini_chat, 'model', None):
+                return
+            game = await dnd_game.get_game(game_channel_id)
+            if not game or game.get("narration_turns"):
+                return
+            user_prompt, fingerprint = await self._opening_prompt(dnd_game, game)
+            model = self.gemini_chat.get_model(DM_SYSTEM_PROMPT)
+            response = await self.gateway.submit(model.generate_content, user_prompt, guild_id=guild_id)
+
+            # Characters may have changed while the scene was being written
+            game = await dnd_game.get_game(game_channel_id)
+            if game and (await self._opening_prompt(dnd_game, game))[1] == fingerprint:
+                game["opening_scene"] = {"fingerprint": fingerprint, "text": response.text}
+                await dnd_game.save_game(game_channel_id, game)
+        except Exception as e:
+            print(f"Error pre-generating opening scene for game {game_channel_id}: {e}")
 
     @commands.command(name="roll")
     async def roll_dice(self, ctx):
@@ -99,12 +283,10 @@ class EmoNarration(commands.Cog):
             await ctx.send("Game setup isn't ready yet.")
             return
 
-        game = None
         channel_id = str(ctx.channel.id)
-        for stored_game in (dnd_game.active_games.values() if not dnd_game.use_mongo else dnd_game.games_collection.find()):
-            if stored_game.get("ooc_thread_id") == channel_id:
-                game = stored_game
-                break
+        game = await dnd_game.find_game_by_any_channel(channel_id)
+        if game and game.get("ooc_thread_id") != channel_id:
+            game = None
 
         if not game or game.get("state") != "started" or not isinstance(ctx.channel, discord.Thread):
             await ctx.send("You can only use !roll in the OOC thread after the game has started!")
@@ -364,45 +546,89 @@ class EmoNarration(commands.Cog):
 
     @commands.Cog.listener()
     async def on_message(self, message):
-        if message.author == self.bot.user or not message.reference:
-            return
-
-        # Check if this is a reply to Emo in an IC chat
         dnd_game = self.bot.get_cog('DnDGame')
-        if not dnd_game:
+        # Only replies in the IC channel of an AI-GM game matter; everything
+        # else is rejected here without any I/O
+        if not dnd_game or str(message.channel.id) not in dnd_game.ai_ic_channels:
             return
-
-        game = None
-        for stored_game in (dnd_game.active_games.values() if not dnd_game.use_mongo else dnd_game.games_collection.find()):
-            if stored_game.get("ic_channel_id") == str(message.channel.id):
-                game = stored_game
-                break
-
-        if not game or not game.get("is_ai_gm"):
+        if message.author == self.bot.user:
+            self.emo_message_ids.set(message.id, True)
+            return
+        if not message.reference or not await self._replies_to_emo(message):
             return
 
-        # Check if replying to Emo's message
-        replied_msg = await message.channel.fetch_message(message.reference.message_id)
-        if replied_msg.author != self.bot.user:
+        game = await dnd_game.find_game_by_any_channel(message.channel.id)
+        if not game or not game.get("is_ai_gm") or game.get("ic_channel_id") != str(message.channel.id):
             return
 
-        # Continue the story with simpler style
-        character_details = []
-        for pid in game["player_ids"]:
-            char = game["characters"][pid]
-            name = char.get("name", "Unknown")
-            race = char.get("race", "Unknown")
-            char_class = char.get("class", "Unknown")
-            spells = ", ".join(char.get("spells", [])) or "None"
-            skills = ", ".join(char.get("skills", [])) or "None"
-            traits = ", ".join(char.get("traits", [])) or "None"
-            equipment = ", ".join(char.get("equipment", [])) or "None"
-            character_details.append(f"{name} (Race: {race}, Class: {char_class}, Spells: {spells}, Skills: {skills}, Traits: {traits}, Equipment: {equipment})")
-        system_prompt = "You are Emo, a Dungeon Master for a DnD adventure. Narrate in third-person perspective (e.g., 'Mira tries to reach out'), using simple, clear language. Describe scenes and actions directly, explain dice rolls clearly (e.g., 'roll a d20 and add Persuasion bonus'), and weave in character details (race, class, skills, traits, equipment). Respond to player choices with checks when needed, and keep responses short (up to 7 lines)."
-        user_prompt = f"Continue the {game['theme']} adventure with characters: {'; '.join(character_details)}. Player action: {message.content}"
-        async with message.channel.typing():
-            narration = await self.get_gemini_response(system_prompt, user_prompt, str(message.channel.id))
-            await message.reply(narration)
+        self.queue_action(game, message)
+
+    async def _replies_to_emo(self, message):
+        """Whether `message` replies to Emo, fetching the referenced message only as a last resort"""
+        referenced = message.reference.resolved
+        if isinstance(referenced, discord.Message):
+            return referenced.author == self.bot.user
+        if self.emo_message_ids.get(message.reference.message_id):
+            return True
+        if isinstance(referenced, discord.DeletedReferencedMessage):
+            return False
+        try:
+            replied_msg = await message.channel.fetch_message(message.reference.message_id)
+        except discord.HTTPException:
+            return False
+        return replied_msg.author == self.bot.user
+
+    def queue_action(self, game, message):
+        """Add a player's action to the channel's batch, narrating it once complete"""
+        channel_id = str(message.channel.id)
+        batch = self.pending_actions.setdefault(channel_id, {"messages": [], "actors": set(), "timer": None})
+        batch["messages"].append(message)
+        batch["actors"].add(str(message.author.id))
+
+        if batch["actors"] >= set(game["player_ids"]):
+            # Everyone has acted; no reason to wait out the window
+            del self.pending_actions[channel_id]
+            if batch["timer"]:
+                batch["timer"].cancel()
+            self._track(asyncio.create_task(self.narrate_actions(channel_id, batch["messages"])))
+        elif not batch["timer"]:
+            batch["timer"] = asyncio.create_task(self._flush_actions_after(channel_id, self.action_window))
+            self._track(batch["timer"])
+
+    async def _flush_actions_after(self, channel_id, delay):
+        await asyncio.sleep(delay)
+        batch = self.pending_actions.pop(channel_id, None)
+        if batch:
+            await self.narrate_actions(channel_id, batch["messages"])
+
+    async def narrate_actions(self, channel_id, messages):
+        """Continue the story with one narration covering every batched action"""
+        lock = self.narration_locks.setdefault(channel_id, asyncio.Lock())
+        async with lock:
+            try:
+                dnd_game = self.bot.get_cog('DnDGame')
+                game = await dnd_game.find_game_by_any_channel(channel_id) if dnd_game else None
+                if not game:
+                    return
+                party = await dnd_game.get_party_prompt(game)
+                actions = []
+                for msg in messages:
+                    char = game["characters"].get(str(msg.author.id), {})
+                    actions.append(f"- {char.get('name', msg.author.display_name)}: {msg.content}")
+
+                user_prompt = (f"Continue the {game['theme']} adventure, responding to all of these "
+                               f"player actions in one narration:\n" + "\n".join(actions) +
+                               f"\nParty ({PARTY_LEGEND}):\n{party}")
+                last = messages[-1]
+                async with last.channel.typing():
+                    await self.narrate(user_prompt, channel_id, last.reply, last.channel.send,
+                                       guild_id=last.guild.id, user_id=last.author.id)
+            except Exception as e:
+                print(f"Error narrating batched actions in {channel_id}: {e}")
+
+    def _track(self, task):
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
 
 async def setup(bot):
     await bot.add_cog(EmoNarration(bot))
\ No newline at end of file
@@ -5,9 +5,14 @@ import asyncio
 import re
 import os
 from dotenv import load_dotenv
-from pymongo import MongoClient
 from datetime import datetime, timedelta, timezone
 from discord.ext import commands, tasks  
+from storage import open_store, close_store
+from cache import LRUCache
+from streaming import StreamingMessage, stream_chunks
+from llm_gateway import open_gateway, close_gateway
+from executors import executor_stats
+from vector_memory import VectorMemory, hash_embedding
 
 class GeminiChat(commands.Cog):
     def __init__(self, bot):
@@ -16,42 +21,68 @@ class GeminiChat(commands.Cog):
         # Load environment variables
         load_dotenv()
         api_key = os.getenv('GEMINI_API_KEY')
-        mongo_uri = os.getenv('MONGO_URI')
         
         if not api_key:
             print("WARNING: GEMINI_API_KEY not found in .env file!")
             return
-            
-        if not mongo_uri:
-            print("WARNING: MONGO_URI not found in .env file!")
-            print("Falling back to in-memory storage. Conversations will be lost on restart.")
-            self.use_mongo = False
-            self.conversations = {}
-        else:
-            # Initialize MongoDB connection
-            try:
-                self.mongo_client = MongoClient(mongo_uri)
-                self.db = self.mongo_client['emo_bot']
-                self.conversations_collection = self.db['conversations']
-                self.messages_collection = self.db['conversation_messages']
-                self.use_mongo = True
-                print("Successfully connected to MongoDB")
-                
-                # Create indexes for faster queries
-                self.conversations_collection.create_index("conversation_key")
-                self.messages_collection.create_index("conversation_id")
-                self.messages_collection.create_index("timestamp")
-                
-                # Setup periodic cleanup of old conversations (runs once per day)
-                self.cleanup_old_conversations.start()
-            except Exception as e:
-                print(f"Failed to connect to MongoDB: {e}")
-                print("Falling back to in-memory storage. Conversations will be lost on restart.")
-                self.use_mongo = False
-                self.conversations = {}
+        
+        # Conversations and messages live in the shared store. Live chat
+        # sessions are cached in front of it, bounded by count and idle time so
+        # memory stays predictable; a warm question only writes its message pair.
+        self.store = open_store()
+        self.conversations = LRUCache(
+            max_entries=int(os.getenv('CHAT_SESSION_MAX', 500)),
+            ttl=float(os.getenv('CHAT_SESSION_TTL', 3600))
+        )
+        # Conversation IDs by key, so storing a message pair needs no lookup
+        self.conversation_ids = LRUCache(
+            max_entries=self.conversations.max_entries,
+            ttl=self.conversations.ttl
+        )
+        # [message_count, summarized_count] by key, so deciding whether
+        # compaction is due needs no lookup either
+        self.conversation_counts = LRUCache(
+            max_entries=self.conversations.max_entries,
+            ttl=self.conversations.ttl
+        )
+        
+        # Setup periodic cleanup of old conversations (runs once per day),
+        # deleting them in batches of this size
+        self.cleanup_batch_size = int(os.getenv('CHAT_CLEANUP_BATCH_SIZE', 500))
+        # Conversations idle this many days move to compressed cold storage
+        # (0 disables archiving); archives are deleted after 30 idle days
+        self.archive_after_days = float(os.getenv('CHAT_ARCHIVE_AFTER_DAYS', 7))
+        self.cleanup_old_conversations.start()
             
         # Initialize Gemini API with your key
         genai.configure(api_key=api_key)
+        # Every model call goes through the shared, rate-limited gateway
+        self.gateway = open_gateway()
+        
+        # Window of stored history restored into a chat session
+        self.history_max_turns = int(os.getenv('CHAT_HISTORY_MAX_TURNS', 20))
+        self.history_max_tokens = int(os.getenv('CHAT_HISTORY_MAX_TOKENS', 8000))
+        # Older turns are folded into a rolling summary once the window has
+        # overflowed by this many turns
+        self.summary_batch_turns = int(os.getenv('CHAT_SUMMARY_BATCH_TURNS', 10))
+        self.compacting = set()
+        self.background_tasks = set()
+        
+        # Older exchanges relevant to a new question are recalled from a small
+        # per-conversation vector index and sent ahead of it. `embed` can be
+        # swapped for a real embedding model.
+        self.vector_recall = os.getenv('CHAT_VECTOR_MEMORY', 'true').lower() == 'true'
+        self.vector_top_k = int(os.getenv('CHAT_VECTOR_TOP_K', 3))
+        self.vector_max_items = int(os.getenv('CHAT_VECTOR_MAX_ITEMS', 100))
+        self.embed = hash_embedding
+        self.vector_memories = LRUCache(
+            max_entries=self.conversations.max_entries,
+            ttl=self.conversations.ttl
+        )
+        
+        # Stream responses into Discord by editing the reply as chunks arrive
+        self.stream_responses = os.getenv('STREAM_RESPONSES', 'true').lower() == 'true'
+        self.stream_edit_interval = float(os.getenv('STREAM_EDIT_INTERVAL', 1.5))
         
         # System prompt to customize AI behavior
         self.system_prompt = """
@@ -62,187 +93,314 @@ class GeminiChat(commands.Cog):
         Avoid disclaimers about your nature unless explicitly asked about how you work.
         """
         
-        # Get available models
+        self.generation_config = {
+            "temperature": 0.7,
+            "top_p": 0.95,
+            "top_k": 40,
+            "max_output_tokens": 2048,
+        }
         self.available_models = []
+        # One model per distinct system instruction, so instructions are sent
+        # as model configuration instead of an extra chat round-trip
+        self.models = {}
+
+    async def cog_load(self):
+        """Pick the Gemini model without blocking the event loop"""
+        if not hasattr(self, 'gateway'):
+            return
+        
+        # Connecting and migrating run on the storage executor, off the loop
         try:
-            for model in genai.list_models():
-                self.available_models.append(model.name)
+            await self.store.connect()
+        except Exception as e:
+            print(f"Error opening the conversation store: {e}")
+        
+        # Get available models
+        try:
+            self.available_models = await self.gateway.submit(
+                lambda: [model.name for model in genai.list_models()]
+            )
             print(f"Available models: {self.available_models}")
         except Exception as e:
             print(f"Error listing models: {e}")
         
-        # Create a Gemini model instance - using the newest model available
+        # Create a Gemini model instance - using the newest model available,
+        # trying to use the best available model with fallbacks
+        if "models/gemini-2.0-flash" in self.available_models:
+            self.model_name = 'gemini-2.0-flash'
+        elif "models/gemini-1.5-flash" in self.available_models:
+            self.model_name = 'gemini-1.5-flash'
+        elif "models/gemini-1.5-pro" in self.available_models:
+            self.model_name = 'gemini-1.5-pro'
+        else:
+            self.model_name = 'gemini-pro'
+        
         try:
-            generation_config = {
-                "temperature": 0.7,
-                "top_p": 0.95,
-                "top_k": 40,
-                "max_output_tokens": 2048,
-            }
-            
-            # Try to use the best available model with fallbacks
-            if "models/gemini-2.0-flash" in self.available_models:
-                self.model = genai.GenerativeModel(
-                    'gemini-2.0-flash',
-                    generation_config=generation_config
-                )
-            elif "models/gemini-1.5-flash" in self.available_models:
-                self.model = genai.GenerativeModel(
-                    'gemini-1.5-flash',
-                    generation_config=generation_config
-                )
-            elif "models/gemini-1.5-pro" in self.available_models:
-                self.model = genai.GenerativeModel(
-                    'gemini-1.5-pro',
-                    generation_config=generation_config
-                )
-            else:
-                self.model = genai.GenerativeModel(
-                    'gemini-pro',
-                    generation_config=generation_config
-                )
+            self.model = self.get_model(self.system_prompt)
         except Exception as e:
             print(f"Error creating model: {e}")
 
+    def get_model(self, system_instruction=None):
+        """Return a cached Gemini model configured with `system_instruction`"""
+        model = self.models.get(system_instruction)
+        if model is None:
+            model = genai.GenerativeModel(
+                self.model_name,
+                generation_config=self.generation_config,
+                system_instruction=system_instruction
+            )
+            self.models[system_instruction] = model
+        return model
+
     @tasks.loop(hours=24)
     async def cleanup_old_conversations(self):
         """Clean up conversations older than 30 days"""
-        if not self.use_mongo:
-            return
-            
         try:
             # Find conversations with no activity in the last 30 days
             thirty_days_ago = datetime.now(timezone.utc) - timedelta(days=30)
-            old_conversations = self.conversations_collection.find(
-                {"last_updated": {"$lt": thirty_days_ago}}
-            )
             
-            # Delete the conversations and their messages
-            for conv in old_conversations:
-                self.messages_collection.delete_many({"conversation_id": conv["_id"]})
-                self.conversations_collection.delete_one({"_id": conv["_id"]})
+            # Delete them with their messages one bounded batch at a time, so a
+            # large backlog never turns into one huge query or one per conversation
+            deleted_conversations = deleted_messages = 0
+            while True:
+                batch = await self.store.find_stale_conversations(thirty_days_ago, limit=self.cleanup_batch_size)
+                if not batch:
+                    break
+                conversations, messages = await self.store.delete_conversations([conv["_id"] for conv in batch])
+                for conv in batch:
+                    self._forget_conversation(conv["conversation_key"])
+                deleted_conversations += conversations
+                deleted_messages += messages
+                print(f"Conversation cleanup: {deleted_conversations} conversations deleted so far")
+                if not conversations:
+                    break
+            deleted_archives = await self.store.delete_stale_archives(thirty_days_ago)
+            self.conversations.evict_expired()
                 
-            print(f"Cleaned up old conversations")
+            print(f"Cleaned up {deleted_conversations} old conversations, {deleted_messages} messages "
+                  f"and {deleted_archives} archives")
+            
+            if self.archive_after_days > 0:
+                await self.archive_idle_conversations()
         except Exception as e:
             print(f"Error during conversation cleanup: {e}")
 
-    async def get_conversation(self, conversation_key):
-        """Get or create a conversation"""
-        if not self.use_mongo:
-            # In-memory fallback
-            if conversation_key not in self.conversations:
-                chat = self.model.start_chat(history=[])
-                # Apply the system prompt for new conversations
-                await asyncio.to_thread(chat.send_message, self.system_prompt)
-                self.conversations[conversation_key] = chat
-            return self.conversations[conversation_key]
-        else:
-            # MongoDB implementation
-            conversation = self.conversations_collection.find_one({"conversation_key": conversation_key})
-            
-            if not conversation:
-                # Create a new conversation in the database
-                conversation_id = self.conversations_collection.insert_one({
-                    "conversation_key": conversation_key,
-                    "created_at": datetime.now(timezone.utc),
-                    "last_updated": datetime.now(timezone.utc)
-                }).inserted_id
-                
-                # Start a new chat with Gemini
-                chat = self.model.start_chat(history=[])
-                # Apply system prompt and store it
-                response = await asyncio.to_thread(chat.send_message, self.system_prompt)
-                
-                # Store system prompt in messages collection
-                self.messages_collection.insert_one({
-                    "conversation_id": conversation_id,
-                    "role": "user",
-                    "content": self.system_prompt,
-                    "is_system_prompt": True,
-                    "timestamp": datetime.now(timezone.utc)
-                })
-                
-                self.messages_collection.insert_one({
-                    "conversation_id": conversation_id,
-                    "role": "model",
-                    "content": response.text,
-                    "is_system_prompt": True,
-                    "timestamp": datetime.now(timezone.utc)
-                })
-                
-                return chat
-            else:
-                # Restore conversation from database
-                chat = self.model.start_chat(history=[])
-                messages = self.messages_collection.find(
-                    {"conversation_id": conversation["_id"]}
-                ).sort("timestamp", 1)  # Sort by timestamp ascending
-                
-                # Restore message history to the chat
-                for msg in messages:
-                    if msg.get("is_system_prompt", False):
-                        continue  # Skip the system prompt, it's already been applied
-                    
-                    # Simulate the message exchange to rebuild history
-                    if msg["role"] == "user":
-                        try:
-                            response = await asyncio.to_thread(chat.send_message, msg["content"])
-                            # Verify the response matches what we have stored
-                            stored_response = self.messages_collection.find_one({
-                                "conversation_id": conversation["_id"],
-                                "role": "model",
-                                "timestamp": {"$gt": msg["timestamp"]}
-                            }, sort=[("timestamp", 1)])
-                            
-                            if stored_response and response.text != stored_response["content"]:
-                                print("Warning: Restored response doesn't match stored response")
-                        except Exception as e:
-                            print(f"Error restoring conversation: {e}")
-                            # If we encounter an error, start a fresh chat
-                            return self.model.start_chat(history=[])
-                
-                # Update last accessed timestamp
-                self.conversations_collection.update_one(
-                    {"_id": conversation["_id"]},
-                    {"$set": {"last_updated": datetime.now(timezone.utc)}}
-                )
-                
-                return chat
+    def _forget_conversation(self, conversation_key):
+        """Drop everything cached for a conversation that was deleted or archived"""
+        self.conversations.pop(conversation_key, None)
+        self.conversation_ids.pop(conversation_key, None)
+        self.conversation_counts.pop(conversation_key, None)
+        self.vector_memories.pop(conversation_key, None)
 
-    async def store_message(self, conversation_key, user_message, ai_response):
-        """Store message history in MongoDB"""
-        if not self.use_mongo:
-            return  # No need to store if not using MongoDB
-            
+    async def archive_idle_conversations(self):
+        """Move idle conversations out of the hot tables in bounded batches"""
+        cutoff = datetime.now(timezone.utc) - timedelta(days=self.archive_after_days)
+        archived = 0
+        while True:
+            scanned, keys = await self.store.archive_conversations(cutoff, limit=self.cleanup_batch_size)
+            # Archived conversations get a new ID when restored, so nothing
+            # cached for them may be used again
+            for conversation_key in keys:
+                self._forget_conversation(conversation_key)
+            archived += len(keys)
+            # Batches where every conversation became active again archive
+            # nothing but still move on, so keep going until none are found
+            if not scanned:
+                break
+            print(f"Conversation archiving: {archived} conversations archived so far")
+        if archived:
+            print(f"Archived {archived} idle conversations")
+
+    async def get_conversation(self, conversation_key, channel_id, user_id):
+        """Get or create the conversation of `user_id` in `channel_id`"""
+        chat = self.conversations.get(conversation_key)
+        if chat is not None:
+            return chat
+        
+        # One round trip finds or creates the conversation and marks it active;
+        # later questions keep it active through add_messages. Only the most
+        # recent window is loaded, newest first, so the restore cost stays flat
+        # however old the conversation is; turns already folded into the
+        # summary are never loaded again. No model calls.
+        conversation = await self.store.get_or_create_conversation(conversation_key, channel_id, user_id)
+        self.conversation_ids.set(conversation_key, conversation["_id"])
+        self._cache_counts(conversation_key, conversation)
+        unsummarized = (conversation.get("message_count", self.history_max_turns * 2)
+                        - conversation.get("summarized_count", 0))
+        limit = min(unsummarized, self.history_max_turns * 2)
+        messages = await self.store.get_recent_messages(conversation["_id"], limit) if limit > 0 else []
+        # The system prompt is part of the model
+        chat = self.model.start_chat(history=self._build_history(messages, conversation.get("summary")))
+        self.conversations.set(conversation_key, chat)
+        return chat
+
+    def _build_history(self, messages, summary=None):
+        """Build a Gemini history payload from stored messages (newest first)
+        
+        Keeps at most `history_max_turns` user/model pairs and stops once the
+        estimated token budget is used up. A rolling summary of older turns,
+        when present, opens the history. No model calls are made.
+        """
+        history = []
+        token_budget = self.history_max_tokens
+        if summary:
+            token_budget -= self._estimate_tokens(summary)
+        for msg in messages:
+            tokens = self._estimate_tokens(msg["content"])
+            if history and tokens > token_budget:
+                break
+            token_budget -= tokens
+            history.append({"role": msg["role"], "parts": [{"text": msg["content"]}]})
+        
+        history.reverse()
+        # Gemini expects the history to open with a user turn
+        while history and history[0]["role"] != "user":
+            history.pop(0)
+        if summary:
+            history[:0] = [
+                {"role": "user", "parts": [{"text": f"Summary of our earlier conversation: {summary}"}]},
+                {"role": "model", "parts": [{"text": "Got it, I remember our earlier conversation."}]}
+            ]
+        return history
+
+    def _cache_counts(self, conversation_key, conversation):
+        if "message_count" in conversation:
+            self.conversation_counts.set(conversation_key, [
+                conversation["message_count"], conversation.get("summarized_count", 0)
+            ])
+
+    def _compaction_due(self, message_count, summarized_count):
+        unsummarized = message_count - summarized_count
+        return unsummarized > self.history_max_turns * 2 + self.summary_batch_turns * 2
+
+    def _schedule_compaction(self, conversation_key):
+        """Fold old turns into the summary in the background, off the reply path"""
+        if conversation_key in self.compacting:
+            return
+        # Only go to the store once the cached counts say the window overflowed
+        counts = self.conversation_counts.get(conversation_key)
+        if counts is not None and not self._compaction_due(*counts):
+            return
+        self.compacting.add(conversation_key)
+        task = asyncio.create_task(self.compact_conversation(conversation_key))
+        self.background_tasks.add(task)
+        task.add_done_callback(self.background_tasks.discard)
+
+    async def compact_conversation(self, conversation_key):
+        """Fold turns that fell out of the verbatim window into the rolling summary
+        
+        Runs only once the window has overflowed by `summary_batch_turns`, so
+        the summary is regenerated incrementally rather than on every question.
+        """
         try:
-            # Find the conversation document
-            conversation = self.conversations_collection.find_one({"conversation_key": conversation_key})
+            conversation = await self.store.get_conversation(conversation_key)
             if not conversation:
                 return
-                
-            # Store user message
-            self.messages_collection.insert_one({
-                "conversation_id": conversation["_id"],
-                "role": "user",
-                "content": user_message,
-                "is_system_prompt": False,
-                "timestamp": datetime.now(timezone.utc)
-            })
+            self._cache_counts(conversation_key, conversation)
+            summarized = conversation.get("summarized_count", 0)
+            unsummarized = conversation.get("message_count", 0) - summarized
+            window = self.history_max_turns * 2
+            if not self._compaction_due(conversation.get("message_count", 0), summarized):
+                return
             
-            # Store AI response
-            self.messages_collection.insert_one({
-                "conversation_id": conversation["_id"],
-                "role": "model",
-                "content": ai_response,
-                "is_system_prompt": False,
-                "timestamp": datetime.now(timezone.utc)
+            messages = await self.store.get_messages_range(conversation["_id"], summarized, unsummarized - window)
+            transcript = "\n".join(
+                f"{'User' if msg['role'] == 'user' else 'Emo'}: {msg['content']}" for msg in messages
+            )
+            prompt = (
+                "Update the running summary of a conversation between a user and Emo.\n"
+                f"Current summary: {conversation.get('summary') or '(none yet)'}\n\n"
+                f"New exchanges:\n{transcript}\n\n"
+                "Write the updated summary in under 150 words. Keep names, facts, preferences "
+                "and open questions; drop small talk."
+            )
+            response = await self.gateway.submit(self.get_model().generate_content, prompt)
+            await self.store.update_conversation(conversation["_id"], {
+                "summary": response.text.strip(),
+                "summarized_count": summarized + len(messages)
             })
+            counts = self.conversation_counts.get(conversation_key)
+            if counts is not None:
+                counts[1] = max(counts[1], summarized + len(messages))
+            # Drop the live session so the next question starts from summary + window
+            self.conversations.pop(conversation_key, None)
+        except Exception as e:
+            print(f"Error summarizing conversation {conversation_key}: {e}")
+        finally:
+            self.compacting.discard(conversation_key)
+
+    async def _vector_memory(self, conversation_key):
+        """The recall index, loaded from the store only when it isn't cached"""
+        memory = self.vector_memories.get(conversation_key)
+        if memory is None:
+            conversation_id = self.conversation_ids.get(conversation_key)
+            if conversation_id is None:
+                conversation = await self.store.get_conversation(conversation_key)
+                conversation_id = conversation and conversation["_id"]
+            entries = await self.store.get_vector_entries(conversation_id) if conversation_id is not None else []
+            memory = VectorMemory.from_entries(entries, self.embed, self.vector_max_items)
+            self.vector_memories.set(conversation_key, memory)
+        return memory
+
+    async def _with_recall(self, conversation_key, question):
+        """Prefix `question` with the most relevant exchanges older than the history window"""
+        if not self.vector_recall:
+            return question
+        memory = await self._vector_memory(conversation_key)
+        recalled = memory.search(question, k=self.vector_top_k, skip_recent=self.history_max_turns)
+        if not recalled:
+            return question
+        exchanges = "\n".join(f"User: {q}\nEmo: {a}" for q, a in recalled)
+        return f"(Earlier in our conversation:\n{exchanges})\n\n{question}"
+
+    @staticmethod
+    def _estimate_tokens(text):
+        """Rough token estimate (~4 characters per token)"""
+        return len(text) // 4 + 1
+
+    async def store_message(self, conversation_key, user_message, ai_response):
+        """Store a user/model message pair in the conversation store"""
+        try:
+            conversation_id = self.conversation_ids.get(conversation_key)
+            if conversation_id is None:
+                conversation = await self.store.get_conversation(conversation_key)
+                if not conversation:
+                    return
+                conversation_id = conversation["_id"]
+                self.conversation_ids.set(conversation_key, conversation_id)
+                self._cache_counts(conversation_key, conversation)
             
-            # Update last_updated timestamp
-            self.conversations_collection.update_one(
-                {"_id": conversation["_id"]},
-                {"$set": {"last_updated": datetime.now(timezone.utc)}}
-            )
+            # The new exchange is appended to the stored recall index with the
+            # same call, as one small entry
+            vector_entry = None
+            if self.vector_recall:
+                memory = await self._vector_memory(conversation_key)
+                vector_entry = memory.add(user_message, ai_response)
+            
+            # Store user message and AI response in one batch; the store
+            # bumps message_count and last_updated with the same write.
+            # The reply is stamped a millisecond later so the pair never ties
+            # at the store's millisecond precision.
+            now = datetime.now(timezone.utc)
+            await self.store.add_messages(conversation_id, [
+                {
+                    "role": "user",
+                    "content": user_message,
+                    "is_system_prompt": False,
+                    "timestamp": now
+                },
+                {
+                    "role": "model",
+                    "content": ai_response,
+                    "is_system_prompt": False,
+                    "timestamp": now + timedelta(milliseconds=1)
+                }
+            ], vector_entry, self.vector_max_items)
+            counts = self.conversation_counts.get(conversation_key)
+            if counts is not None:
+                counts[0] += 2
+            
+            self._schedule_compaction(conversation_key)
         except Exception as e:
             print(f"Error storing messages: {e}")
 
@@ -261,16 +419,25 @@ class GeminiChat(commands.Cog):
             
             # Get or create conversation
             try:
-                chat = await self.get_conversation(conversation_key)
+                chat = await self.get_conversation(conversation_key, ctx.channel.id, ctx.author.id)
             except Exception as e:
                 await thinking_msg.edit(content=f"⚠️ Error starting chat: {str(e)}")
                 return
             
+            # Relevant older exchanges ride along with the question
+            prompt = await self._with_recall(conversation_key, question)
+            
+            if self.stream_responses:
+                await self._ask_streaming(ctx, thinking_msg, chat, conversation_key, question, prompt)
+                return
+            
             # Send the question to Gemini
             try:
-                response = await asyncio.to_thread(
+                response = await self.gateway.submit(
                     chat.send_message,
-                    question
+                    prompt,
+                    guild_id=ctx.guild.id if ctx.guild else None,
+                    user_id=ctx.author.id
                 )
             except Exception as e:
                 await thinking_msg.edit(content=f"⚠️ Error sending message: {str(e)}")
@@ -282,7 +449,7 @@ class GeminiChat(commands.Cog):
             # Remove any "As a language model" or similar phrases
             response_text = self._clean_ai_disclaimers(response_text)
             
-            # Store the message pair in MongoDB if available
+            # Store the message pair
             await self.store_message(conversation_key, question, response_text)
             
             # Split the response if it's too long for Discord (2000 char limit)
@@ -305,10 +472,32 @@ class GeminiChat(commands.Cog):
         except Exception as e:
             await ctx.send(f"⚠️ Error: {str(e)}")
             # Reset conversation on error
-            if not self.use_mongo:
-                conversation_key = f"{ctx.channel.id}_{ctx.author.id}"
-                if conversation_key in self.conversations:
-                    del self.conversations[conversation_key]
+            self.conversations.pop(f"{ctx.channel.id}_{ctx.author.id}", None)
+    
+    async def _ask_streaming(self, ctx, thinking_msg, chat, conversation_key, question, prompt):
+        """Answer `question` by editing the thinking message as chunks arrive"""
+        streamer = StreamingMessage(
+            thinking_msg,
+            ctx.send,
+            self._split_text,
+            prefix=f"**You asked:** {question}\n\n**Emo says:** ",
+            continuation="**Emo continues:** ",
+            edit_interval=self.stream_edit_interval
+        )
+        try:
+            runner = self.gateway.runner(guild_id=ctx.guild.id if ctx.guild else None, user_id=ctx.author.id)
+            async for chunk in stream_chunks(chat.send_message, prompt, runner=runner):
+                await streamer.append(chunk)
+        except Exception as e:
+            await thinking_msg.edit(content=f"⚠️ Error sending message: {str(e)}")
+            return
+        
+        # Remove any "As a language model" or similar phrases
+        response_text = self._clean_ai_disclaimers(streamer.text)
+        await streamer.finish(response_text)
+        
+        # Store the message pair
+        await self.store_message(conversation_key, question, response_text)
     
     @commands.command()
     async def list_models(self, ctx):
@@ -317,12 +506,49 @@ class GeminiChat(commands.Cog):
         Example: !list_models
         """
         try:
-            models = genai.list_models()
-            model_names = [model.name for model in models]
+            model_names = await self.gateway.submit(
+                lambda: [model.name for model in genai.list_models()],
+                guild_id=ctx.guild.id if ctx.guild else None,
+                user_id=ctx.author.id
+            )
             await ctx.send(f"Available Gemini models:\n```\n{', '.join(model_names)}\n```")
         except Exception as e:
             await ctx.send(f"⚠️ Error listing models: {str(e)}")
     
+    @commands.command()
+    async def chat_stats(self, ctx):
+        """Show Emo's chat session cache statistics
+        
+        Example: !chat_stats
+        """
+        stats = self.conversations.stats()
+        await ctx.send(
+            f"**Chat sessions:** {stats['size']}/{stats['max_entries']}\n"
+            f"**Hits:** {stats['hits']} | **Misses:** {stats['misses']} | **Hit rate:** {stats['hit_rate']:.0%}\n"
+            f"**Evicted:** {stats['evictions']} | **Expired:** {stats['expirations']}"
+        )
+    
+    @commands.command()
+    async def llm_stats(self, ctx):
+        """Show the Gemini request queue, rate limit and thread pool statistics
+        
+        Example: !llm_stats
+        """
+        stats = self.gateway.stats()
+        guild_depth = stats["queued_per_guild"].get(ctx.guild.id if ctx.guild else None, 0)
+        lines = [
+            f"**Gemini requests in flight:** {stats['in_flight']}/{stats['max_concurrency']}",
+            f"**Queued:** {stats['queued']} (this server: {guild_depth})",
+            f"**Completed:** {stats['completed']} | **Failed:** {stats['failed']} | **Rate limited:** {stats['throttled']}",
+            f"**Average wait:** {stats['avg_wait']:.2f}s"
+        ]
+        for pool in executor_stats():
+            lines.append(
+                f"**{pool['name']} threads:** {pool['active']}/{pool['max_workers']} busy, {pool['waiting']} waiting, "
+                f"avg wait {pool['avg_wait']:.2f}s (max {pool['max_wait']:.2f}s)"
+            )
+        await ctx.send("\n".join(lines))
+    
     @commands.command()
     async def reset_chat(self, ctx):
         """Reset your chat history with Emo in this channel
@@ -330,24 +556,17 @@ class GeminiChat(commands.Cog):
         Example: !reset_chat
         """
         conversation_key = f"{ctx.channel.id}_{ctx.author.id}"
+        self._forget_conversation(conversation_key)
         
-        if not self.use_mongo:
-            if conversation_key in self.conversations:
-                del self.conversations[conversation_key]
-                await ctx.send("✅ Your chat history with Emo has been reset for this channel!")
-            else:
-                await ctx.send("You don't have an active chat with Emo in this channel.")
+        conversation = await self.store.get_conversation(conversation_key)
+        if conversation:
+            # Delete the conversation and all of its messages
+            await self.store.delete_conversation(conversation["_id"])
+        archived = await self.store.delete_archives(ctx.author.id, channel_id=ctx.channel.id)
+        if conversation or archived:
+            await ctx.send("✅ Your chat history with Emo has been reset for this channel!")
         else:
-            # MongoDB implementation
-            conversation = self.conversations_collection.find_one({"conversation_key": conversation_key})
-            if conversation:
-                # Delete all messages for this conversation
-                self.messages_collection.delete_many({"conversation_id": conversation["_id"]})
-                # Delete the conversation itself
-                self.conversations_collection.delete_one({"_id": conversation["_id"]})
-                await ctx.send("✅ Your chat history with Emo has been reset for this channel!")
-            else:
-                await ctx.send("You don't have an active chat with Emo in this channel.")
+            await ctx.send("You don't have an active chat with Emo in this channel.")
     
     @commands.command()
     async def reset_all_chats(self, ctx):
@@ -357,41 +576,22 @@ class GeminiChat(commands.Cog):
         """
         user_id = ctx.author.id
         
-        if not self.use_mongo:
-            # Find all conversations for this user
-            user_conversations = [key for key in self.conversations.keys() if key.endswith(f"_{user_id}")]
+        # Find all conversations for this user
+        user_conversations = await self.store.find_user_conversations(user_id)
+        archived = await self.store.delete_archives(user_id)
+        
+        if user_conversations or archived:
+            # Delete all messages and conversations in one batch
+            for conversation in user_conversations:
+                self._forget_conversation(conversation["conversation_key"])
+            conversations, messages = await self.store.delete_conversations(
+                [conversation["_id"] for conversation in user_conversations]
+            )
             
-            if user_conversations:
-                # Delete all conversations for this user
-                for key in user_conversations:
-                    del self.conversations[key]
-                await ctx.send(f"✅ All your chat histories with Emo have been reset across {len(user_conversations)} channels!")
-            else:
-                await ctx.send("You don't have any active chats with Emo.")
+            await ctx.send(f"✅ All your chat histories with Emo have been reset across {conversations + archived} channels "
+                           f"({messages} messages deleted)!")
         else:
-            # MongoDB implementation
-            pattern = f".*_{user_id}$"
-            cursor = self.conversations_collection.find({"conversation_key": {"$regex": pattern}})
-            
-            conversation_count = 0
-            conversation_ids = []
-            
-            # Collect all conversation IDs first
-            for conversation in cursor:
-                conversation_ids.append(conversation["_id"])
-                conversation_count += 1
-                
-            # Then delete all messages and conversations
-            if conversation_ids:
-                for conv_id in conversation_ids:
-                    # Delete all messages for this conversation
-                    self.messages_collection.delete_many({"conversation_id": conv_id})
-                    # Delete the conversation itself
-                    self.conversations_collection.delete_one({"_id": conv_id})
-                
-                await ctx.send(f"✅ All your chat histories with Emo have been reset across {conversation_count} channels!")
-            else:
-                await ctx.send("You don't have any active chats with Emo.")
+            await ctx.send("You don't have any active chats with Emo.")
     
     def _clean_ai_disclaimers(self, text):
         """Remove AI disclaimers from the response text"""
@@ -468,9 +668,11 @@ class GeminiChat(commands.Cog):
     
     def cog_unload(self):
         """Clean up resources when the cog is unloaded"""
-        if self.use_mongo:
+        if hasattr(self, 'store'):
             self.cleanup_old_conversations.cancel()
-            self.mongo_client.close()
+            close_store()
+        if hasattr(self, 'gateway'):
+            close_gateway()
 
 async def setup(bot):
     await bot.add_cog(GeminiChat(bot))
\ No newline at end of file
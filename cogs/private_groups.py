@@ -77,6 +77,8 @@ class CommandsDropdown(ui.Select):
         embed.add_field(name="!reset_chat", value="Reset conversation history in this channel.\nExample: `!reset_chat`", inline=False)
         embed.add_field(name="!reset_all_chats", value="Reset all conversation histories.\nExample: `!reset_all_chats`", inline=False)
         embed.add_field(name="!list_models", value="List available AI models.\nExample: `!list_models`", inline=False)
+        embed.add_field(name="!chat_stats", value="Show chat session cache statistics.\nExample: `!chat_stats`", inline=False)
+        embed.add_field(name="!llm_stats", value="Show the AI request queue and rate limit statistics.\nExample: `!llm_stats`", inline=False)
         embed.set_footer(text="Select another category from the dropdown menu")
         return embed
         
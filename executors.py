@@ -0,0 +1,121 @@
+"""Named thread pools for blocking work.
+
+Model calls and storage calls get separate, separately sized pools so a few
+slow generations can't hold up database I/O (and vice versa). Each pool tracks
+how busy it is and how long work waits before a thread picks it up.
+
+Size the pools with LLM_EXECUTOR_WORKERS and STORAGE_EXECUTOR_WORKERS.
+"""
+import asyncio
+import contextvars
+import functools
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from dotenv import load_dotenv
+
+
+class InstrumentedExecutor:
+    """Thread pool that records saturation and queue wait times"""
+
+    def __init__(self, name, max_workers):
+        self.name = name
+        self.max_workers = max_workers
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"emo-{name}")
+        self.lock = threading.Lock()
+        self.waiting = 0
+        self.active = 0
+        self.completed = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+
+    async def run(self, fn, *args, **kwargs):
+        """Run `fn(*args, **kwargs)` on the pool and await its result"""
+        queued_at = time.monotonic()
+        context = contextvars.copy_context()
+        call = functools.partial(context.run, fn, *args, **kwargs)
+        # Whoever takes the job off the queue first (a thread, or a
+        # cancellation before any thread got to it) counts it out of `waiting`
+        queued = True
+
+        def tracked():
+            nonlocal queued
+            wait = time.monotonic() - queued_at
+            with self.lock:
+                if queued:
+                    queued = False
+                    self.waiting -= 1
+                self.active += 1
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+            try:
+                return call()
+            finally:
+                with self.lock:
+                    self.active -= 1
+                    self.completed += 1
+
+        with self.lock:
+            self.waiting += 1
+        try:
+            return await asyncio.get_running_loop().run_in_executor(self.executor, tracked)
+        except asyncio.CancelledError:
+            with self.lock:
+                if queued:
+                    queued = False
+                    self.waiting -= 1
+            raise
+
+    def stats(self):
+        with self.lock:
+            started = self.completed + self.active
+            return {
+                "name": self.name,
+                "max_workers": self.max_workers,
+                "active": self.active,
+                "waiting": self.waiting,
+                "saturation": self.active / self.max_workers,
+                "completed": self.completed,
+                "avg_wait": self.total_wait / started if started else 0.0,
+                "max_wait": self.max_wait
+            }
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False)
+
+
+_executors = {}
+_executor_users = 0
+_default_workers = {"llm": 8, "storage": 8}
+
+
+def get_executor(name):
+    """Return the shared executor `name` ("llm" or "storage")"""
+    if name not in _executors:
+        load_dotenv()
+        max_workers = int(os.getenv(f"{name.upper()}_EXECUTOR_WORKERS", _default_workers.get(name, 4)))
+        _executors[name] = InstrumentedExecutor(name, max_workers)
+    return _executors[name]
+
+
+def open_executors():
+    """Register a user of the shared executors (the store or the LLM gateway)"""
+    global _executor_users
+    _executor_users += 1
+
+
+def close_executors():
+    """Release the shared executors; their threads stop when the last user lets go"""
+    global _executor_users
+    _executor_users -= 1
+    if _executor_users <= 0:
+        for executor in _executors.values():
+            executor.shutdown()
+        _executors.clear()
+        _executor_users = 0
+
+
+def executor_stats():
+    return [executor.stats() for executor in _executors.values()]
@@ -0,0 +1,185 @@
+"""Shared gateway for every Gemini call made by the bot.
+
+Calls are queued per guild and per user and served round-robin, so a burst
+from one guild can't starve the others. A bounded pool of workers caps how
+many calls run at once and a sliding-window limiter keeps the bot under its
+requests-per-minute quota.
+
+Configure with LLM_MAX_CONCURRENCY and LLM_REQUESTS_PER_MINUTE (0 disables
+the rate limit).
+"""
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+
+from dotenv import load_dotenv
+
+from executors import close_executors, get_executor, open_executors
+
+
+class RateLimiter:
+    """Allows at most `requests_per_minute` acquisitions in any 60 second window"""
+
+    def __init__(self, requests_per_minute):
+        self.requests_per_minute = requests_per_minute
+        self.calls = deque()
+        self.lock = asyncio.Lock()
+        self.throttled = 0
+
+    async def acquire(self):
+        if not self.requests_per_minute:
+            return
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                while self.calls and now - self.calls[0] >= 60:
+                    self.calls.popleft()
+                if len(self.calls) < self.requests_per_minute:
+                    self.calls.append(now)
+                    return
+                self.throttled += 1
+                await asyncio.sleep(60 - (now - self.calls[0]))
+
+
+class _Job:
+    __slots__ = ("fn", "args", "kwargs", "future", "queued_at")
+
+    def __init__(self, fn, args, kwargs, future):
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+        self.future = future
+        self.queued_at = time.monotonic()
+
+
+class LLMGateway:
+    """Fair, rate-limited queue in front of blocking model calls"""
+
+    def __init__(self, max_concurrency=4, requests_per_minute=60):
+        self.max_concurrency = max_concurrency
+        self.rate_limiter = RateLimiter(requests_per_minute)
+        # guild key -> user key -> queued jobs; both levels are served round-robin
+        self.queues = OrderedDict()
+        self.jobs_available = None
+        self.workers = []
+        self.queued = 0
+        self.in_flight = 0
+        self.completed = 0
+        self.failed = 0
+        self.total_wait = 0.0
+
+    async def submit(self, fn, *args, guild_id=None, user_id=None, **kwargs):
+        """Queue `fn(*args, **kwargs)` and return its result once a worker ran it"""
+        self._ensure_workers()
+        future = asyncio.get_running_loop().create_future()
+        users = self.queues.setdefault(guild_id, OrderedDict())
+        users.setdefault(user_id, deque()).append(_Job(fn, args, kwargs, future))
+        self.queued += 1
+        self.jobs_available.release()
+        return await future
+
+    def runner(self, guild_id=None, user_id=None):
+        """Return a `runner(fn)` coroutine factory bound to one requester"""
+        return lambda fn, *args, **kwargs: self.submit(fn, *args, guild_id=guild_id, user_id=user_id, **kwargs)
+
+    def _ensure_workers(self):
+        if self.workers:
+            return
+        self.jobs_available = asyncio.Semaphore(0)
+        self.workers = [asyncio.create_task(self._worker()) for _ in range(self.max_concurrency)]
+
+    def _next_job(self):
+        guild_id, users = next(iter(self.queues.items()))
+        user_id, jobs = next(iter(users.items()))
+        job = jobs.popleft()
+        self.queued -= 1
+        # Rotate the user and the guild to the back of their queues
+        if jobs:
+            users.move_to_end(user_id)
+        else:
+            del users[user_id]
+        if users:
+            self.queues.move_to_end(guild_id)
+        else:
+            del self.queues[guild_id]
+        return job
+
+    async def _worker(self):
+        while True:
+            await self.jobs_available.acquire()
+            job = self._next_job()
+            if job.future.cancelled():
+                continue
+            await self.rate_limiter.acquire()
+            self.total_wait += time.monotonic() - job.queued_at
+            self.in_flight += 1
+            try:
+                result = await get_executor("llm").run(job.fn, *job.args, **job.kwargs)
+            except Exception as e:
+                self.failed += 1
+                if not job.future.cancelled():
+                    job.future.set_exception(e)
+            else:
+                self.completed += 1
+                if not job.future.cancelled():
+                    job.future.set_result(result)
+            finally:
+                self.in_flight -= 1
+
+    def stats(self):
+        started = self.completed + self.failed + self.in_flight
+        return {
+            "queued": self.queued,
+            "queued_per_guild": {guild_id: sum(len(jobs) for jobs in users.values())
+                                 for guild_id, users in self.queues.items()},
+            "in_flight": self.in_flight,
+            "max_concurrency": self.max_concurrency,
+            "completed": self.completed,
+            "failed": self.failed,
+            "throttled": self.rate_limiter.throttled,
+            "avg_wait": self.total_wait / started if started else 0.0
+        }
+
+    def close(self):
+        """Stop the workers; calls still queued are cancelled rather than left hanging"""
+        for worker in self.workers:
+            worker.cancel()
+        self.workers = []
+        for users in self.queues.values():
+            for jobs in users.values():
+                for job in jobs:
+                    job.future.cancel()
+        self.queues.clear()
+        self.queued = 0
+
+
+_gateway = None
+_gateway_users = 0
+
+
+def open_gateway():
+    """Return the gateway shared by all cogs, creating it on first use"""
+    global _gateway, _gateway_users
+    if _gateway is None:
+        load_dotenv()
+        _gateway = LLMGateway(
+            max_concurrency=int(os.getenv('LLM_MAX_CONCURRENCY', 4)),
+            requests_per_minute=int(os.getenv('LLM_REQUESTS_PER_MINUTE', 60))
+        )
+        open_executors()
+    _gateway_users += 1
+    return _gateway
+
+
+def close_gateway():
+    """Release the shared gateway; its workers stop when the last cog lets go"""
+    global _gateway, _gateway_users
+    if _gateway is None:
+        return
+    _gateway_users -= 1
+    if _gateway_users <= 0:
+        _gateway.close()
+        _gateway = None
+        _gateway_users = 0
+        close_executors()
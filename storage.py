@@ -0,0 +1,1180 @@
+"""Storage layer shared by the DnDGame and GeminiChat cogs.
+
+Every backend exposes the same synchronous methods. Cogs talk to them through
+AsyncStore, which runs blocking backends on the storage thread pool so a slow
+database round-trip never stalls the Discord gateway loop. The backend itself
+(connection, indexes and migrations) is created there as well, by the first
+`await store.connect()` or store call.
+
+Select a backend with STORAGE_BACKEND=memory|sqlite|mongo. Without it, Mongo is
+used when MONGO_URI is set and memory otherwise.
+
+Idle conversations can be archived: the conversation and all of its messages
+are packed into one compressed blob kept apart from the hot tables, and
+unpacked again by get_or_create_conversation when the user comes back.
+"""
+import asyncio
+import copy
+import json
+import os
+import sqlite3
+import threading
+import zlib
+from collections import defaultdict, deque
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+from executors import close_executors, get_executor, open_executors
+
+
+def diff_documents(old, new, prefix=""):
+    """Compare two versions of a document and return the changed paths
+
+    Returns (set_fields, unset_fields, push_fields) keyed by dotted paths.
+    Nested dicts are compared key by key, lists that only grew are reported as
+    appends and lists of the same length as per-index updates.
+    """
+    set_fields, unset_fields, push_fields = {}, [], {}
+    for key, value in new.items():
+        path = f"{prefix}{key}"
+        if key not in old:
+            set_fields[path] = value
+            continue
+        old_value = old[key]
+        if value == old_value:
+            continue
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            nested = diff_documents(old_value, value, path + ".")
+            set_fields.update(nested[0])
+            unset_fields.extend(nested[1])
+            push_fields.update(nested[2])
+        elif isinstance(value, list) and isinstance(old_value, list) and old_value:
+            if len(value) > len(old_value) and value[:len(old_value)] == old_value:
+                push_fields[path] = value[len(old_value):]
+            elif len(value) == len(old_value):
+                for i, (item, old_item) in enumerate(zip(value, old_value)):
+                    if item != old_item:
+                        set_fields[f"{path}.{i}"] = item
+            else:
+                set_fields[path] = value
+        else:
+            set_fields[path] = value
+    unset_fields.extend(f"{prefix}{key}" for key in old if key not in new)
+    return set_fields, unset_fields, push_fields
+
+
+def apply_update(document, set_fields=None, unset_fields=None, push_fields=None):
+    """Apply dotted-path changes from diff_documents to a plain document"""
+    def resolve(path):
+        *parents, last = path.split(".")
+        target = document
+        for part in parents:
+            target = target[int(part)] if isinstance(target, list) else target.setdefault(part, {})
+        return target, (int(last) if isinstance(target, list) else last)
+
+    for path, value in (set_fields or {}).items():
+        target, key = resolve(path)
+        target[key] = value
+    for path in unset_fields or []:
+        target, key = resolve(path)
+        target.pop(key, None)
+    for path, values in (push_fields or {}).items():
+        target, key = resolve(path)
+        target.setdefault(key, []).extend(values)
+    return document
+
+
+_ARCHIVE_DATETIME_FIELDS = ("created_at", "last_updated", "timestamp")
+
+
+def pack_conversation(conversation, messages, vectors=None):
+    """Compress a conversation record, its messages (oldest first) and recall entries into one blob"""
+    def encode(document):
+        return {key: value.isoformat() if isinstance(value, datetime) else value
+                for key, value in document.items() if key not in ("_id", "id", "conversation_id")}
+
+    payload = {"conversation": encode(conversation), "messages": [encode(msg) for msg in messages],
+               "vectors": list(vectors or [])}
+    return zlib.compress(json.dumps(payload, default=str).encode("utf-8"), 9)
+
+
+def unpack_conversation(blob):
+    """Inverse of pack_conversation; returns (conversation, messages, vectors) without IDs"""
+    def decode(document):
+        for key in _ARCHIVE_DATETIME_FIELDS:
+            if isinstance(document.get(key), str):
+                document[key] = datetime.fromisoformat(document[key])
+        return document
+
+    payload = json.loads(zlib.decompress(blob).decode("utf-8"))
+    return (decode(payload["conversation"]), [decode(msg) for msg in payload["messages"]],
+            payload.get("vectors", []))
+
+
+class MemoryBackend:
+    """Keeps everything in process. Data is lost on restart.
+
+    At most `max_conversations` conversations (and as many archives) are kept,
+    the least recently active ones are dropped first, and messages are dropped
+    once they have been folded into the summary.
+    """
+    persistent = False
+    blocking = False
+
+    def __init__(self, max_conversations=1000):
+        self.max_conversations = max_conversations
+        self.games = {}
+        self.channel_index = {}  # IC channel / OOC thread ID -> game channel ID
+        self.conversations = {}  # conversation ID -> conversation record
+        self.conversation_keys = {}  # conversation key -> conversation ID
+        self.user_conversations = {}  # user ID -> set of conversation IDs
+        self.messages = {}  # conversation ID -> list of messages (oldest first)
+        self.vectors = {}  # conversation ID -> recall index entries (oldest first)
+        self.archives = {}  # conversation key -> archived conversation
+        self._next_id = 1
+
+    # Games
+
+    @staticmethod
+    def _export_game(game):
+        # Capped lists are kept as deques internally but handed out as lists.
+        # Callers get their own copy, like a document read from a database,
+        # so changing it in place can't reach the stored game.
+        if game is None:
+            return None
+        return copy.deepcopy({key: list(value) if isinstance(value, deque) else value
+                              for key, value in game.items()})
+
+    def get_game(self, channel_id):
+        return self._export_game(self.games.get(str(channel_id)))
+
+    def save_game(self, channel_id, game_data):
+        self.games[str(channel_id)] = game_data = copy.deepcopy(game_data)
+        for key in ("ic_channel_id", "ooc_thread_id"):
+            if game_data.get(key):
+                self.channel_index[game_data[key]] = str(channel_id)
+
+    def update_game_fields(self, channel_id, set_fields, unset_fields, push_fields):
+        game = self.games.get(str(channel_id))
+        if game is not None:
+            self.save_game(channel_id, apply_update(self._export_game(game), set_fields, unset_fields, push_fields))
+
+    def append_to_game_list(self, channel_id, field, entries, max_items):
+        game = self.games.get(str(channel_id))
+        if game is None:
+            return
+        items = game.get(field)
+        if not isinstance(items, deque) or items.maxlen != max_items:
+            items = game[field] = deque(items or [], maxlen=max_items)
+        items.extend(copy.deepcopy(entries))
+
+    def delete_game(self, channel_id):
+        game = self.games.pop(str(channel_id), None)
+        if game:
+            for key in ("ic_channel_id", "ooc_thread_id"):
+                self.channel_index.pop(game.get(key), None)
+
+    def find_game_by_any_channel(self, channel_id):
+        game_channel_id = self.channel_index.get(str(channel_id))
+        return self._export_game(self.games.get(game_channel_id)) if game_channel_id else None
+
+    def find_ai_gm_channels(self):
+        return [game["ic_channel_id"] for game in self.games.values()
+                if game.get("is_ai_gm") and game.get("ic_channel_id")]
+
+    # Conversations
+
+    def get_conversation(self, conversation_key):
+        conversation_id = self.conversation_keys.get(conversation_key)
+        return self.conversations.get(conversation_id) if conversation_id else None
+
+    def _create_conversation(self, conversation_key, channel_id, user_id):
+        conversation_id = self._next_id
+        self._next_id += 1
+        now = datetime.now(timezone.utc)
+        self.conversations[conversation_id] = {
+            "_id": conversation_id,
+            "conversation_key": conversation_key,
+            "channel_id": str(channel_id),
+            "user_id": str(user_id),
+            "created_at": now,
+            "last_updated": now,
+            "summarized_count": 0,
+            "message_count": 0
+        }
+        self.conversation_keys[conversation_key] = conversation_id
+        self.user_conversations.setdefault(str(user_id), set()).add(conversation_id)
+        self.messages[conversation_id] = []
+        if self.max_conversations and len(self.conversations) > self.max_conversations:
+            oldest = min((conv for conv in self.conversations.values() if conv["_id"] != conversation_id),
+                         key=lambda conv: conv["last_updated"])
+            self.delete_conversation(oldest["_id"])
+        return conversation_id
+
+    def get_or_create_conversation(self, conversation_key, channel_id, user_id):
+        conversation = self.get_conversation(conversation_key) or self._restore_archive(conversation_key)
+        if conversation is None:
+            return self.conversations[self._create_conversation(conversation_key, channel_id, user_id)]
+        conversation["last_updated"] = datetime.now(timezone.utc)
+        return conversation
+
+    def _restore_archive(self, conversation_key):
+        archive = self.archives.pop(conversation_key, None)
+        if archive is None:
+            return None
+        record, messages, vectors = unpack_conversation(archive["data"])
+        conversation_id = self._create_conversation(conversation_key, record["channel_id"], record["user_id"])
+        conversation = self.conversations[conversation_id]
+        conversation.update(record)
+        self.messages[conversation_id] = messages
+        if vectors:
+            self.vectors[conversation_id] = vectors
+        return conversation
+
+    def update_conversation(self, conversation_id, fields):
+        conversation = self.conversations.get(conversation_id)
+        if conversation is None:
+            return
+        conversation.update(fields)
+        self._drop_summarized(conversation)
+
+    def _drop_summarized(self, conversation):
+        """Forget messages already folded into the summary; they are never read again"""
+        drop = conversation.get("summarized_count", 0) - conversation.get("dropped_count", 0)
+        if drop <= 0:
+            return
+        kept = []
+        for msg in self.messages.get(conversation["_id"], []):
+            if drop and not msg.get("is_system_prompt", False):
+                drop -= 1
+                conversation["dropped_count"] = conversation.get("dropped_count", 0) + 1
+                continue
+            kept.append(msg)
+        self.messages[conversation["_id"]] = kept
+
+    def add_messages(self, conversation_id, messages, vector_entry=None, max_vectors=None):
+        conversation = self.conversations.get(conversation_id)
+        if conversation is None:
+            # Deleted or evicted meanwhile; keeping the messages would only leak them
+            return
+        self.messages.setdefault(conversation_id, []).extend(messages)
+        conversation["message_count"] = conversation.get("message_count", 0) + sum(
+            1 for msg in messages if not msg.get("is_system_prompt", False))
+        conversation["last_updated"] = datetime.now(timezone.utc)
+        if vector_entry is not None:
+            entries = self.vectors.setdefault(conversation_id, [])
+            entries.append(vector_entry)
+            if max_vectors:
+                del entries[:-max_vectors]
+
+    def get_vector_entries(self, conversation_id):
+        """Recall index entries of a conversation, oldest first"""
+        return list(self.vectors.get(conversation_id, ()))
+
+    def get_recent_messages(self, conversation_id, limit):
+        """Newest-first messages, excluding the stored system prompt"""
+        result = []
+        for msg in reversed(self.messages.get(conversation_id, [])):
+            if msg.get("is_system_prompt", False):
+                continue
+            result.append(msg)
+            if len(result) >= limit:
+                break
+        return result
+
+    def get_messages_range(self, conversation_id, skip, limit):
+        """Oldest-first messages starting at `skip`, excluding the system prompt"""
+        messages = [msg for msg in self.messages.get(conversation_id, [])
+                    if not msg.get("is_system_prompt", False)]
+        # `skip` counts from the first message ever stored, including dropped ones
+        skip = max(skip - self.conversations.get(conversation_id, {}).get("dropped_count", 0), 0)
+        return messages[skip:skip + limit]
+
+    def find_user_conversations(self, user_id):
+        return [self.conversations[conversation_id]
+                for conversation_id in self.user_conversations.get(str(user_id), ())]
+
+    def find_stale_conversations(self, cutoff, limit=None):
+        stale = [conv for conv in self.conversations.values() if conv["last_updated"] < cutoff]
+        return stale[:limit] if limit else stale
+
+    def delete_conversation(self, conversation_id):
+        conversation = self.conversations.pop(conversation_id, None)
+        if conversation:
+            self.conversation_keys.pop(conversation["conversation_key"], None)
+            self.user_conversations.get(conversation["user_id"], set()).discard(conversation_id)
+        self.messages.pop(conversation_id, None)
+        self.vectors.pop(conversation_id, None)
+
+    def delete_conversations(self, conversation_ids):
+        """Delete several conversations; returns (conversations, messages) deleted"""
+        conversations = messages = 0
+        for conversation_id in conversation_ids:
+            conversations += conversation_id in self.conversations
+            messages += len(self.messages.get(conversation_id, ()))
+            self.delete_conversation(conversation_id)
+        return conversations, messages
+
+    def archive_conversations(self, cutoff, limit=None):
+        """Pack conversations idle since `cutoff` into archives
+
+        Returns (scanned, archived keys). Conversations that became active
+        while the batch was packed are scanned but not archived.
+        """
+        stale = self.find_stale_conversations(cutoff, limit)
+        for conversation in stale:
+            self.archives[conversation["conversation_key"]] = {
+                "channel_id": conversation["channel_id"],
+                "user_id": conversation["user_id"],
+                "last_updated": conversation["last_updated"],
+                "data": pack_conversation(conversation, self.messages.get(conversation["_id"], []),
+                                          self.vectors.get(conversation["_id"]))
+            }
+            self.delete_conversation(conversation["_id"])
+        if self.max_conversations and len(self.archives) > self.max_conversations:
+            by_age = sorted(self.archives, key=lambda key: self.archives[key]["last_updated"])
+            for key in by_age[:len(self.archives) - self.max_conversations]:
+                del self.archives[key]
+        return len(stale), [conversation["conversation_key"] for conversation in stale]
+
+    def delete_stale_archives(self, cutoff):
+        stale = [key for key, archive in self.archives.items() if archive["last_updated"] < cutoff]
+        for key in stale:
+            del self.archives[key]
+        return len(stale)
+
+    def delete_archives(self, user_id, channel_id=None):
+        """Delete a user's archived conversations, optionally only in one channel"""
+        keys = [key for key, archive in self.archives.items()
+                if archive["user_id"] == str(user_id)
+                and (channel_id is None or archive["channel_id"] == str(channel_id))]
+        for key in keys:
+            del self.archives[key]
+        return len(keys)
+
+    def close(self):
+        pass
+
+
+class SQLiteBackend:
+    """Local single-file storage for bots running without MongoDB"""
+    persistent = True
+    blocking = True
+
+    def __init__(self, path):
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.row_factory = sqlite3.Row
+        self.lock = threading.Lock()
+        with self.lock, self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS games (
+                    channel_id TEXT PRIMARY KEY,
+                    ic_channel_id TEXT,
+                    ooc_thread_id TEXT,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_games_ic_channel ON games (ic_channel_id);
+                CREATE INDEX IF NOT EXISTS idx_games_ooc_thread ON games (ooc_thread_id);
+                CREATE TABLE IF NOT EXISTS conversations (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    conversation_key TEXT UNIQUE NOT NULL,
+                    created_at TEXT NOT NULL,
+                    last_updated TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_conversations_last_updated ON conversations (last_updated);
+                CREATE TABLE IF NOT EXISTS conversation_messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    conversation_id INTEGER NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    is_system_prompt INTEGER NOT NULL DEFAULT 0,
+                    timestamp TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_messages_conversation ON conversation_messages (conversation_id, id);
+                CREATE TABLE IF NOT EXISTS conversation_vectors (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    conversation_id INTEGER NOT NULL,
+                    data TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_vectors_conversation ON conversation_vectors (conversation_id, id);
+                CREATE TABLE IF NOT EXISTS conversation_archives (
+                    conversation_key TEXT PRIMARY KEY,
+                    channel_id TEXT,
+                    user_id TEXT,
+                    last_updated TEXT NOT NULL,
+                    data BLOB NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS idx_archives_user ON conversation_archives (user_id, channel_id);
+                CREATE INDEX IF NOT EXISTS idx_archives_last_updated ON conversation_archives (last_updated);
+            """)
+            added = self._add_missing_columns("conversations", {
+                "summary": "TEXT",
+                "summarized_count": "INTEGER NOT NULL DEFAULT 0",
+                "message_count": "INTEGER NOT NULL DEFAULT 0",
+                "channel_id": "TEXT",
+                "user_id": "TEXT"
+            })
+            if "message_count" in added:
+                # Existing conversations start from their real size, not 0,
+                # so their history is still restored and compacted correctly
+                self.connection.execute(
+                    "UPDATE conversations SET message_count = (SELECT COUNT(*) FROM conversation_messages "
+                    "WHERE conversation_id = conversations.id AND is_system_prompt = 0)"
+                )
+            # Conversations created before channel_id/user_id existed get
+            # them from their "<channel_id>_<user_id>" key
+            self.connection.execute(
+                "UPDATE conversations SET "
+                "channel_id = substr(conversation_key, 1, instr(conversation_key, '_') - 1), "
+                "user_id = substr(conversation_key, instr(conversation_key, '_') + 1) "
+                "WHERE user_id IS NULL AND instr(conversation_key, '_') > 0"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_conversations_user ON conversations (user_id, channel_id)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS idx_conversations_channel ON conversations (channel_id)"
+            )
+
+    def _add_missing_columns(self, table, columns):
+        """Bring tables created by older versions up to date; returns the added column names"""
+        existing = {row["name"] for row in self.connection.execute(f"PRAGMA table_info({table})")}
+        added = []
+        for name, declaration in columns.items():
+            if name not in existing:
+                self.connection.execute(f"ALTER TABLE {table} ADD COLUMN {name} {declaration}")
+                added.append(name)
+        return added
+
+    @staticmethod
+    def _conversation_record(row):
+        return {
+            "_id": row["id"],
+            "conversation_key": row["conversation_key"],
+            "channel_id": row["channel_id"],
+            "user_id": row["user_id"],
+            "created_at": datetime.fromisoformat(row["created_at"]),
+            "last_updated": datetime.fromisoformat(row["last_updated"]),
+            "summary": row["summary"],
+            "summarized_count": row["summarized_count"],
+            "message_count": row["message_count"]
+        }
+
+    # Games
+
+    def get_game(self, channel_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data FROM games WHERE channel_id = ?", (str(channel_id),)
+            ).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def save_game(self, channel_id, game_data):
+        with self.lock, self.connection:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO games (channel_id, ic_channel_id, ooc_thread_id, data) VALUES (?, ?, ?, ?)",
+                (str(channel_id), game_data.get("ic_channel_id"), game_data.get("ooc_thread_id"),
+                 json.dumps(game_data, default=str))
+            )
+
+    def update_game_fields(self, channel_id, set_fields, unset_fields, push_fields):
+        # SQLite stores the game as one JSON value, so patch it inside a
+        # single transaction instead of shipping the document back and forth
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT data FROM games WHERE channel_id = ?", (str(channel_id),)
+            ).fetchone()
+            if not row:
+                return
+            game = apply_update(json.loads(row["data"]), set_fields, unset_fields, push_fields)
+            self.connection.execute(
+                "UPDATE games SET ic_channel_id = ?, ooc_thread_id = ?, data = ? WHERE channel_id = ?",
+                (game.get("ic_channel_id"), game.get("ooc_thread_id"), json.dumps(game, default=str), str(channel_id))
+            )
+
+    def append_to_game_list(self, channel_id, field, entries, max_items):
+        with self.lock, self.connection:
+            row = self.connection.execute(
+                "SELECT data FROM games WHERE channel_id = ?", (str(channel_id),)
+            ).fetchone()
+            if not row:
+                return
+            game = json.loads(row["data"])
+            game[field] = ((game.get(field) or []) + entries)[-max_items:]
+            self.connection.execute(
+                "UPDATE games SET data = ? WHERE channel_id = ?", (json.dumps(game, default=str), str(channel_id))
+            )
+
+    def delete_game(self, channel_id):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM games WHERE channel_id = ?", (str(channel_id),))
+
+    def find_game_by_any_channel(self, channel_id):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT data FROM games WHERE ic_channel_id = ?1 OR ooc_thread_id = ?1", (str(channel_id),)
+            ).fetchone()
+        return json.loads(row["data"]) if row else None
+
+    def find_ai_gm_channels(self):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT ic_channel_id FROM games WHERE ic_channel_id IS NOT NULL "
+                "AND json_extract(data, '$.is_ai_gm')"
+            ).fetchall()
+        return [row["ic_channel_id"] for row in rows]
+
+    # Conversations
+
+    def get_conversation(self, conversation_key):
+        with self.lock:
+            row = self.connection.execute(
+                "SELECT * FROM conversations WHERE conversation_key = ?", (conversation_key,)
+            ).fetchone()
+        return self._conversation_record(row) if row else None
+
+    def get_or_create_conversation(self, conversation_key, channel_id, user_id):
+        now = datetime.now(timezone.utc).isoformat()
+        with self.lock, self.connection:
+            exists = self.connection.execute(
+                "SELECT 1 FROM conversations WHERE conversation_key = ?", (conversation_key,)
+            ).fetchone()
+            if not exists:
+                self._restore_archive(conversation_key)
+            self.connection.execute(
+                "INSERT INTO conversations (conversation_key, channel_id, user_id, created_at, last_updated) "
+                "VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (conversation_key) DO UPDATE SET last_updated = excluded.last_updated",
+                (conversation_key, str(channel_id), str(user_id), now, now)
+            )
+            row = self.connection.execute(
+                "SELECT * FROM conversations WHERE conversation_key = ?", (conversation_key,)
+            ).fetchone()
+        return self._conversation_record(row)
+
+    def _restore_archive(self, conversation_key):
+        # Runs inside the caller's transaction
+        row = self.connection.execute(
+            "SELECT data FROM conversation_archives WHERE conversation_key = ?", (conversation_key,)
+        ).fetchone()
+        if not row:
+            return
+        record, messages, vectors = unpack_conversation(row["data"])
+        conversation_id = self.connection.execute(
+            "INSERT INTO conversations (conversation_key, channel_id, user_id, created_at, last_updated, "
+            "summary, summarized_count, message_count) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (conversation_key, record.get("channel_id"), record.get("user_id"),
+             record["created_at"].isoformat(), record["last_updated"].isoformat(), record.get("summary"),
+             record.get("summarized_count", 0), record.get("message_count", 0))
+        ).lastrowid
+        self.connection.executemany(
+            "INSERT INTO conversation_vectors (conversation_id, data) VALUES (?, ?)",
+            [(conversation_id, json.dumps(entry)) for entry in vectors]
+        )
+        self.connection.executemany(
+            "INSERT INTO conversation_messages (conversation_id, role, content, is_system_prompt, timestamp) "
+            "VALUES (?, ?, ?, ?, ?)",
+            [(conversation_id, msg["role"], msg["content"], int(msg.get("is_system_prompt", False)),
+              msg["timestamp"].isoformat()) for msg in messages]
+        )
+        self.connection.execute("DELETE FROM conversation_archives WHERE conversation_key = ?", (conversation_key,))
+
+    def update_conversation(self, conversation_id, fields):
+        columns = [name for name in fields if name in ("summary", "summarized_count")]
+        if not columns:
+            return
+        with self.lock, self.connection:
+            self.connection.execute(
+                f"UPDATE conversations SET {', '.join(f'{name} = ?' for name in columns)} WHERE id = ?",
+                [fields[name] for name in columns] + [conversation_id]
+            )
+
+    def add_messages(self, conversation_id, messages, vector_entry=None, max_vectors=None):
+        with self.lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO conversation_messages (conversation_id, role, content, is_system_prompt, timestamp) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(conversation_id, msg["role"], msg["content"], int(msg.get("is_system_prompt", False)),
+                  msg["timestamp"].isoformat()) for msg in messages]
+            )
+            self.connection.execute(
+                "UPDATE conversations SET message_count = message_count + ?, last_updated = ? WHERE id = ?",
+                (sum(1 for msg in messages if not msg.get("is_system_prompt", False)),
+                 datetime.now(timezone.utc).isoformat(), conversation_id)
+            )
+            if vector_entry is not None:
+                self.connection.execute(
+                    "INSERT INTO conversation_vectors (conversation_id, data) VALUES (?, ?)",
+                    (conversation_id, json.dumps(vector_entry))
+                )
+                if max_vectors:
+                    self.connection.execute(
+                        "DELETE FROM conversation_vectors WHERE conversation_id = ? AND id <= ("
+                        "SELECT id FROM conversation_vectors WHERE conversation_id = ? "
+                        "ORDER BY id DESC LIMIT 1 OFFSET ?)",
+                        (conversation_id, conversation_id, max_vectors)
+                    )
+
+    def get_vector_entries(self, conversation_id):
+        """Recall index entries of a conversation, oldest first"""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT data FROM conversation_vectors WHERE conversation_id = ? ORDER BY id", (conversation_id,)
+            ).fetchall()
+        return [json.loads(row["data"]) for row in rows]
+
+    def get_recent_messages(self, conversation_id, limit):
+        """Newest-first messages, excluding the stored system prompt"""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT role, content FROM conversation_messages "
+                "WHERE conversation_id = ? AND is_system_prompt = 0 ORDER BY id DESC LIMIT ?",
+                (conversation_id, limit)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def get_messages_range(self, conversation_id, skip, limit):
+        """Oldest-first messages starting at `skip`, excluding the system prompt"""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT role, content FROM conversation_messages "
+                "WHERE conversation_id = ? AND is_system_prompt = 0 ORDER BY id LIMIT ? OFFSET ?",
+                (conversation_id, limit, skip)
+            ).fetchall()
+        return [dict(row) for row in rows]
+
+    def find_user_conversations(self, user_id):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM conversations WHERE user_id = ?", (str(user_id),)
+            ).fetchall()
+        return [self._conversation_record(row) for row in rows]
+
+    def find_stale_conversations(self, cutoff, limit=None):
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT * FROM conversations WHERE last_updated < ? ORDER BY last_updated LIMIT ?",
+                (cutoff.isoformat(), limit or -1)
+            ).fetchall()
+        return [self._conversation_record(row) for row in rows]
+
+    def delete_conversation(self, conversation_id):
+        with self.lock, self.connection:
+            self.connection.execute("DELETE FROM conversation_messages WHERE conversation_id = ?", (conversation_id,))
+            self.connection.execute("DELETE FROM conversation_vectors WHERE conversation_id = ?", (conversation_id,))
+            self.connection.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,))
+
+    def delete_conversations(self, conversation_ids):
+        """Delete several conversations; returns (conversations, messages) deleted"""
+        conversation_ids = list(conversation_ids)
+        if not conversation_ids:
+            return 0, 0
+        placeholders = ", ".join("?" * len(conversation_ids))
+        with self.lock, self.connection:
+            messages = self.connection.execute(
+                f"DELETE FROM conversation_messages WHERE conversation_id IN ({placeholders})", conversation_ids
+            ).rowcount
+            self.connection.execute(
+                f"DELETE FROM conversation_vectors WHERE conversation_id IN ({placeholders})", conversation_ids
+            )
+            conversations = self.connection.execute(
+                f"DELETE FROM conversations WHERE id IN ({placeholders})", conversation_ids
+            ).rowcount
+        return conversations, messages
+
+    def archive_conversations(self, cutoff, limit=None):
+        """Pack conversations idle since `cutoff` into archives
+
+        Returns (scanned, archived keys). Conversations that became active
+        while the batch was packed are scanned but not archived.
+        """
+        # Selecting inside the same locked transaction keeps a conversation
+        # that gets a new message meanwhile from being archived without it
+        with self.lock, self.connection:
+            stale = [self._conversation_record(row) for row in self.connection.execute(
+                "SELECT * FROM conversations WHERE last_updated < ? ORDER BY last_updated LIMIT ?",
+                (cutoff.isoformat(), limit or -1)
+            ).fetchall()]
+            if not stale:
+                return 0, []
+            conversation_ids = [conversation["_id"] for conversation in stale]
+            placeholders = ", ".join("?" * len(conversation_ids))
+            messages = defaultdict(list)
+            for row in self.connection.execute(
+                "SELECT conversation_id, role, content, is_system_prompt, timestamp FROM conversation_messages "
+                f"WHERE conversation_id IN ({placeholders}) ORDER BY id", conversation_ids
+            ):
+                messages[row["conversation_id"]].append({
+                    "role": row["role"],
+                    "content": row["content"],
+                    "is_system_prompt": bool(row["is_system_prompt"]),
+                    "timestamp": row["timestamp"]
+                })
+            vectors = defaultdict(list)
+            for row in self.connection.execute(
+                f"SELECT conversation_id, data FROM conversation_vectors WHERE conversation_id IN ({placeholders}) "
+                "ORDER BY id", conversation_ids
+            ):
+                vectors[row["conversation_id"]].append(json.loads(row["data"]))
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO conversation_archives (conversation_key, channel_id, user_id, last_updated, data) "
+                "VALUES (?, ?, ?, ?, ?)",
+                [(conversation["conversation_key"], conversation["channel_id"], conversation["user_id"],
+                  conversation["last_updated"].isoformat(),
+                  pack_conversation(conversation, messages[conversation["_id"]], vectors[conversation["_id"]]))
+                 for conversation in stale]
+            )
+            self.connection.execute(
+                f"DELETE FROM conversation_messages WHERE conversation_id IN ({placeholders})", conversation_ids
+            )
+            self.connection.execute(
+                f"DELETE FROM conversation_vectors WHERE conversation_id IN ({placeholders})", conversation_ids
+            )
+            self.connection.execute(f"DELETE FROM conversations WHERE id IN ({placeholders})", conversation_ids)
+        return len(stale), [conversation["conversation_key"] for conversation in stale]
+
+    def delete_stale_archives(self, cutoff):
+        with self.lock, self.connection:
+            return self.connection.execute(
+                "DELETE FROM conversation_archives WHERE last_updated < ?", (cutoff.isoformat(),)
+            ).rowcount
+
+    def delete_archives(self, user_id, channel_id=None):
+        """Delete a user's archived conversations, optionally only in one channel"""
+        query = "DELETE FROM conversation_archives WHERE user_id = ?"
+        params = [str(user_id)]
+        if channel_id is not None:
+            query += " AND channel_id = ?"
+            params.append(str(channel_id))
+        with self.lock, self.connection:
+            return self.connection.execute(query, params).rowcount
+
+    def close(self):
+        self.connection.close()
+
+
+class MongoBackend:
+    """MongoDB storage using the synchronous pymongo driver"""
+    persistent = True
+    blocking = True
+
+    def __init__(self, mongo_uri):
+        from pymongo import MongoClient
+
+        self.mongo_client = MongoClient(mongo_uri)
+        self.db = self.mongo_client['emo_bot']
+        self.games_collection = self.db['dnd_games']
+        self.conversations_collection = self.db['conversations']
+        self.messages_collection = self.db['conversation_messages']
+        self.archives_collection = self.db['conversation_archives']
+
+        # Create indexes for faster queries
+        self.games_collection.create_index("channel_id", unique=True)
+        self.games_collection.create_index("ic_channel_id", sparse=True)
+        self.games_collection.create_index("ooc_thread_id", sparse=True)
+        self._migrate_unique_conversation_keys()
+        self._migrate_conversation_owners()
+        self._migrate_message_counts()
+        self.conversations_collection.create_index([("user_id", 1), ("channel_id", 1)])
+        self.conversations_collection.create_index("channel_id")
+        self.conversations_collection.create_index("last_updated")
+        self.archives_collection.create_index("conversation_key", unique=True)
+        self.archives_collection.create_index([("user_id", 1), ("channel_id", 1)])
+        self.archives_collection.create_index("last_updated")
+        # Serves both the per-conversation lookups and their timestamp order
+        self.messages_collection.create_index([("conversation_id", 1), ("timestamp", 1)])
+        self.messages_collection.create_index("timestamp")
+
+    # Games
+
+    def get_game(self, channel_id):
+        return self.games_collection.find_one({"channel_id": str(channel_id)})
+
+    def save_game(self, channel_id, game_data):
+        self.games_collection.update_one(
+            {"channel_id": str(channel_id)},
+            {"$set": game_data},
+            upsert=True
+        )
+
+    def update_game_fields(self, channel_id, set_fields, unset_fields, push_fields):
+        update = {}
+        if set_fields:
+            update["$set"] = set_fields
+        if unset_fields:
+            update["$unset"] = {path: "" for path in unset_fields}
+        if push_fields:
+            update["$push"] = {path: {"$each": values} for path, values in push_fields.items()}
+        if update:
+            self.games_collection.update_one({"channel_id": str(channel_id)}, update)
+
+    def append_to_game_list(self, channel_id, field, entries, max_items):
+        self.games_collection.update_one(
+            {"channel_id": str(channel_id)},
+            {"$push": {field: {"$each": entries, "$slice": -max_items}}}
+        )
+
+    def delete_game(self, channel_id):
+        self.games_collection.delete_one({"channel_id": str(channel_id)})
+
+    def find_game_by_any_channel(self, channel_id):
+        channel_id = str(channel_id)
+        return self.games_collection.find_one(
+            {"$or": [{"ic_channel_id": channel_id}, {"ooc_thread_id": channel_id}]}
+        )
+
+    def find_ai_gm_channels(self):
+        cursor = self.games_collection.find(
+            {"is_ai_gm": True, "ic_channel_id": {"$exists": True}}, {"ic_channel_id": 1}
+        )
+        return [game["ic_channel_id"] for game in cursor]
+
+    # Conversations
+
+    # Recall index entries are appended to the conversation document but only
+    # read by get_vector_entries, so they are left out of everything else
+    _CONVERSATION_FIELDS = {"vector_entries": 0}
+
+    def get_conversation(self, conversation_key):
+        return self.conversations_collection.find_one({"conversation_key": conversation_key},
+                                                      self._CONVERSATION_FIELDS)
+
+    def _migrate_unique_conversation_keys(self):
+        """Make conversation_key unique, keeping the newest of any duplicates from older versions
+
+        get_or_create_conversation and archive restores rely on one
+        conversation per key.
+        """
+        index = self.conversations_collection.index_information().get("conversation_key_1")
+        if index and index.get("unique"):
+            return
+        duplicates = self.conversations_collection.aggregate([
+            {"$sort": {"last_updated": -1}},
+            {"$group": {"_id": "$conversation_key", "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}}}
+        ], allowDiskUse=True)
+        removed = [conversation_id for group in duplicates for conversation_id in group["ids"][1:]]
+        for start in range(0, len(removed), 500):
+            self.delete_conversations(removed[start:start + 500])
+        if removed:
+            print(f"Removed {len(removed)} duplicate conversations")
+        if index:
+            self.conversations_collection.drop_index("conversation_key_1")
+        self.conversations_collection.create_index("conversation_key", unique=True)
+
+    def _migrate_conversation_owners(self, batch_size=500):
+        """Give conversations from older versions channel_id/user_id fields parsed from their key"""
+        from pymongo import UpdateOne
+
+        cursor = self.conversations_collection.find({"user_id": {"$exists": False}}, {"conversation_key": 1})
+        updates = []
+        migrated = 0
+        for conversation in cursor:
+            channel_id, _, user_id = conversation["conversation_key"].partition("_")
+            if not user_id:
+                continue
+            updates.append(UpdateOne({"_id": conversation["_id"]},
+                                     {"$set": {"channel_id": channel_id, "user_id": user_id}}))
+            if len(updates) >= batch_size:
+                migrated += self.conversations_collection.bulk_write(updates, ordered=False).modified_count
+                updates = []
+        if updates:
+            migrated += self.conversations_collection.bulk_write(updates, ordered=False).modified_count
+        if migrated:
+            print(f"Added channel_id/user_id to {migrated} conversations")
+
+    def _migrate_message_counts(self, batch_size=500):
+        """Backfill message_count/summarized_count on conversations from older versions
+
+        Without them the first $inc would start message_count at 2 and the
+        restored history and compaction offsets would ignore older messages.
+        """
+        from pymongo import UpdateOne
+
+        self.conversations_collection.update_many(
+            {"summarized_count": {"$exists": False}}, {"$set": {"summarized_count": 0}}
+        )
+        cursor = self.conversations_collection.find({"message_count": {"$exists": False}}, {"_id": 1})
+        migrated = 0
+        batch = []
+        for conversation in cursor:
+            batch.append(conversation["_id"])
+            if len(batch) >= batch_size:
+                migrated += self._backfill_message_counts(batch, UpdateOne)
+                batch = []
+        if batch:
+            migrated += self._backfill_message_counts(batch, UpdateOne)
+        if migrated:
+            print(f"Added message_count to {migrated} conversations")
+
+    def _backfill_message_counts(self, conversation_ids, UpdateOne):
+        counts = {row["_id"]: row["count"] for row in self.messages_collection.aggregate([
+            {"$match": {"conversation_id": {"$in": conversation_ids}, "is_system_prompt": {"$ne": True}}},
+            {"$group": {"_id": "$conversation_id", "count": {"$sum": 1}}}
+        ])}
+        return self.conversations_collection.bulk_write([
+            UpdateOne({"_id": conversation_id, "message_count": {"$exists": False}},
+                      {"$set": {"message_count": counts.get(conversation_id, 0)}})
+            for conversation_id in conversation_ids
+        ], ordered=False).modified_count
+
+    def get_or_create_conversation(self, conversation_key, channel_id, user_id):
+        from pymongo import ReturnDocument
+        from pymongo.errors import DuplicateKeyError
+
+        now = datetime.now(timezone.utc)
+        conversation = self.conversations_collection.find_one_and_update(
+            {"conversation_key": conversation_key},
+            {"$set": {"last_updated": now}},
+            projection=self._CONVERSATION_FIELDS,
+            return_document=ReturnDocument.AFTER
+        )
+        if conversation is None:
+            self._restore_archive(conversation_key)
+            try:
+                conversation = self.conversations_collection.find_one_and_update(
+                    {"conversation_key": conversation_key},
+                    {"$set": {"last_updated": now},
+                     "$setOnInsert": {"channel_id": str(channel_id), "user_id": str(user_id), "created_at": now,
+                                      "summarized_count": 0, "message_count": 0}},
+                    upsert=True,
+                    projection=self._CONVERSATION_FIELDS,
+                    return_document=ReturnDocument.AFTER
+                )
+            except DuplicateKeyError:
+                # A concurrent upsert inserted it first
+                conversation = self.get_conversation(conversation_key)
+        return conversation
+
+    def _restore_archive(self, conversation_key):
+        # find_one_and_delete hands the archive to exactly one concurrent caller
+        archive = self.archives_collection.find_one_and_delete({"conversation_key": conversation_key})
+        if archive is None:
+            return
+        from pymongo.errors import DuplicateKeyError
+
+        record, messages, vectors = unpack_conversation(archive["data"])
+        try:
+            conversation_id = self.conversations_collection.insert_one(
+                dict(record, vector_entries=vectors)).inserted_id
+        except DuplicateKeyError:
+            # A concurrent caller created a fresh conversation meanwhile; fold the
+            # archive into it so neither the archived nor the new messages are lost
+            existing = self.conversations_collection.find_one({"conversation_key": conversation_key}, {"_id": 1})
+            if existing is None:
+                return
+            conversation_id = existing["_id"]
+            fields = {key: value for key, value in record.items()
+                      if key not in ("_id", "conversation_key", "last_updated", "message_count")}
+            self.conversations_collection.update_one(
+                {"_id": conversation_id},
+                {"$set": fields, "$inc": {"message_count": record.get("message_count", 0)},
+                 "$push": {"vector_entries": {"$each": vectors, "$position": 0}}}
+            )
+        if messages:
+            self.messages_collection.insert_many(
+                [dict(msg, conversation_id=conversation_id) for msg in messages]
+            )
+
+    def update_conversation(self, conversation_id, fields):
+        self.conversations_collection.update_one({"_id": conversation_id}, {"$set": fields})
+
+    def add_messages(self, conversation_id, messages, vector_entry=None, max_vectors=None):
+        self.messages_collection.insert_many(
+            [dict(msg, conversation_id=conversation_id) for msg in messages]
+        )
+        update = {"$inc": {"message_count": sum(1 for msg in messages if not msg.get("is_system_prompt", False))},
+                  "$set": {"last_updated": datetime.now(timezone.utc)}}
+        if vector_entry is not None:
+            # Appended in the same write as one small entry, never rewriting the index
+            push = {"$each": [vector_entry]}
+            if max_vectors:
+                push["$slice"] = -max_vectors
+            update["$push"] = {"vector_entries": push}
+        self.conversations_collection.update_one({"_id": conversation_id}, update)
+
+    def get_vector_entries(self, conversation_id):
+        """Recall index entries of a conversation, oldest first"""
+        document = self.conversations_collection.find_one({"_id": conversation_id}, {"vector_entries": 1})
+        return (document or {}).get("vector_entries", [])
+
+    def get_recent_messages(self, conversation_id, limit):
+        """Newest-first messages, excluding the stored system prompt"""
+        return list(self.messages_collection.find(
+            {"conversation_id": conversation_id, "is_system_prompt": {"$ne": True}},
+            {"role": 1, "content": 1}
+        ).sort([("timestamp", -1), ("_id", -1)]).limit(limit))
+
+    def get_messages_range(self, conversation_id, skip, limit):
+        """Oldest-first messages starting at `skip`, excluding the system prompt"""
+        return list(self.messages_collection.find(
+            {"conversation_id": conversation_id, "is_system_prompt": {"$ne": True}},
+            {"role": 1, "content": 1}
+        ).sort([("timestamp", 1), ("_id", 1)]).skip(skip).limit(limit))
+
+    def find_user_conversations(self, user_id):
+        return list(self.conversations_collection.find({"user_id": str(user_id)}, self._CONVERSATION_FIELDS))
+
+    def find_stale_conversations(self, cutoff, limit=None):
+        return list(self.conversations_collection.find(
+            {"last_updated": {"$lt": cutoff}}, {"conversation_key": 1, "last_updated": 1}
+        ).limit(limit or 0))
+
+    def delete_conversation(self, conversation_id):
+        self.messages_collection.delete_many({"conversation_id": conversation_id})
+        self.conversations_collection.delete_one({"_id": conversation_id})
+
+    def delete_conversations(self, conversation_ids):
+        """Delete several conversations; returns (conversations, messages) deleted"""
+        conversation_ids = list(conversation_ids)
+        if not conversation_ids:
+            return 0, 0
+        messages = self.messages_collection.delete_many({"conversation_id": {"$in": conversation_ids}})
+        conversations = self.conversations_collection.delete_many({"_id": {"$in": conversation_ids}})
+        return conversations.deleted_count, messages.deleted_count
+
+    def archive_conversations(self, cutoff, limit=None):
+        """Pack conversations idle since `cutoff` into archives
+
+        Returns (scanned, archived keys). Conversations that became active
+        while the batch was packed are scanned but not archived.
+        """
+        from pymongo import ReplaceOne
+
+        stale = list(self.conversations_collection.find({"last_updated": {"$lt": cutoff}}).limit(limit or 0))
+        if not stale:
+            return 0, []
+        conversation_ids = [conversation["_id"] for conversation in stale]
+        messages = defaultdict(list)
+        cursor = self.messages_collection.find({"conversation_id": {"$in": conversation_ids}})
+        for msg in cursor.sort([("timestamp", 1), ("_id", 1)]):
+            messages[msg["conversation_id"]].append(msg)
+        self.archives_collection.bulk_write([
+            ReplaceOne({"conversation_key": conversation["conversation_key"]}, {
+                "conversation_key": conversation["conversation_key"],
+                "channel_id": conversation.get("channel_id"),
+                "user_id": conversation.get("user_id"),
+                "last_updated": conversation["last_updated"],
+                "data": pack_conversation(
+                    {key: value for key, value in conversation.items() if key != "vector_entries"},
+                    messages[conversation["_id"]], conversation.get("vector_entries"))
+            }, upsert=True)
+            for conversation in stale
+        ], ordered=False)
+        # Only conversations still idle are deleted; any that got a message
+        # since they were read stay live and their fresh archive is dropped
+        self.conversations_collection.delete_many(
+            {"_id": {"$in": conversation_ids}, "last_updated": {"$lt": cutoff}}
+        )
+        kept = list(self.conversations_collection.find(
+            {"_id": {"$in": conversation_ids}}, {"conversation_key": 1}
+        ))
+        if kept:
+            self.archives_collection.delete_many(
+                {"conversation_key": {"$in": [conversation["conversation_key"] for conversation in kept]}}
+            )
+        kept_ids = {conversation["_id"] for conversation in kept}
+        archived_ids = [conversation_id for conversation_id in conversation_ids if conversation_id not in kept_ids]
+        if archived_ids:
+            self.messages_collection.delete_many({"conversation_id": {"$in": archived_ids}})
+        return len(stale), [conversation["conversation_key"] for conversation in stale
+                            if conversation["_id"] not in kept_ids]
+
+    def delete_stale_archives(self, cutoff):
+        return self.archives_collection.delete_many({"last_updated": {"$lt": cutoff}}).deleted_count
+
+    def delete_archives(self, user_id, channel_id=None):
+        """Delete a user's archived conversations, optionally only in one channel"""
+        query = {"user_id": str(user_id)}
+        if channel_id is not None:
+            query["channel_id"] = str(channel_id)
+        return self.archives_collection.delete_many(query).deleted_count
+
+    def close(self):
+        self.mongo_client.close()
+
+
+class AsyncStore:
+    """Async facade over a backend; blocking backends run on the storage executor"""
+
+    def __init__(self, backend=None):
+        # Without a backend, create_backend() builds one on first use
+        self.backend = backend
+        self.connect_lock = asyncio.Lock()
+
+    @property
+    def persistent(self):
+        return self.backend is not None and self.backend.persistent
+
+    async def connect(self):
+        """Create the backend and run its migrations on the storage executor, once"""
+        if self.backend is None:
+            async with self.connect_lock:
+                if self.backend is None:
+                    self.backend = await get_executor("storage").run(create_backend)
+        return self
+
+    def __getattr__(self, name):
+        async def call(*args, **kwargs):
+            await self.connect()
+            method = getattr(self.backend, name)
+            if self.backend.blocking:
+                return await get_executor("storage").run(method, *args, **kwargs)
+            return method(*args, **kwargs)
+
+        return call
+
+
+def create_backend():
+    """Create the backend selected by the environment"""
+    load_dotenv()
+    mongo_uri = os.getenv('MONGO_URI')
+    backend_name = os.getenv('STORAGE_BACKEND', 'mongo' if mongo_uri else 'memory').lower()
+
+    if backend_name == 'sqlite':
+        path = os.getenv('SQLITE_PATH', 'emo_bot.db')
+        print(f"Using SQLite storage at {path}")
+        return SQLiteBackend(path)
+
+    if backend_name == 'mongo':
+        if not mongo_uri:
+            print("WARNING: MONGO_URI not found in .env file!")
+        else:
+            try:
+                backend = MongoBackend(mongo_uri)
+                print("Successfully connected to MongoDB")
+                return backend
+            except Exception as e:
+                print(f"Failed to connect to MongoDB: {e}")
+
+    print("Using in-memory storage. Games and conversations will be lost on restart.")
+    return MemoryBackend(int(os.getenv('MEMORY_MAX_CONVERSATIONS', 1000)))
+
+
+_store = None
+_store_users = 0
+
+
+def open_store():
+    """Return the store shared by all cogs; its backend is created by `await store.connect()`"""
+    global _store, _store_users
+    if _store is None:
+        _store = AsyncStore()
+        open_executors()
+    _store_users += 1
+    return _store
+
+
+def close_store():
+    """Release the shared store; the backend closes when the last cog lets go"""
+    global _store, _store_users
+    if _store is None:
+        return
+    _store_users -= 1
+    if _store_users <= 0:
+        if _store.backend is not None:
+            _store.backend.close()
+        close_executors()
+        _store = None
+        _store_users = 0
@@ -0,0 +1,72 @@
+"""Long-term memory for AI-GM campaigns.
+
+Keeps a running "story so far" summary plus structured notes (locations, NPCs,
+quests) on the game, so narration only needs the summary and the most recent
+turns instead of the whole adventure.
+"""
+import json
+import re
+
+NOTE_KINDS = ("locations", "npcs", "quests")
+NOTE_LABELS = {"locations": "Locations", "npcs": "NPCs", "quests": "Quests"}
+MAX_NOTES_PER_KIND = 15
+
+
+class StoryMemory:
+    """Summary and notes covering every narration turn up to `through_turn`"""
+
+    def __init__(self, data=None):
+        data = data or {}
+        self.summary = data.get("summary", "")
+        self.notes = {kind: list(data.get("notes", {}).get(kind, [])) for kind in NOTE_KINDS}
+        self.through_turn = data.get("through_turn", 0)
+
+    @classmethod
+    def from_game(cls, game):
+        return cls(game.get("story_memory"))
+
+    def to_dict(self):
+        return {"summary": self.summary, "notes": self.notes, "through_turn": self.through_turn}
+
+    def context_prompt(self):
+        """Compact description of the story so far, or "" before the first compaction"""
+        if not self.summary and not any(self.notes.values()):
+            return ""
+        lines = [f"Story so far: {self.summary}"]
+        for kind in NOTE_KINDS:
+            if self.notes[kind]:
+                lines.append(f"{NOTE_LABELS[kind]}: {'; '.join(self.notes[kind])}")
+        return "\n".join(lines)
+
+    def compaction_prompt(self, turns):
+        """Prompt asking the model to fold `turns` into the summary and notes"""
+        transcript = "\n".join(
+            f"{'Players' if entry['role'] == 'user' else 'GM'}: {entry['content']}" for entry in turns
+        )
+        return (
+            "You keep the campaign notes for a D&D game.\n"
+            f"Current notes: {json.dumps(self.to_dict()['notes'])}\n"
+            f"Story so far: {self.summary or '(the adventure just began)'}\n\n"
+            f"New events:\n{transcript}\n\n"
+            "Reply with JSON only, shaped as "
+            '{"summary": "...", "locations": ["..."], "npcs": ["..."], "quests": ["..."]}. '
+            "Keep the summary under 200 words. Each note is one short line "
+            "(name: key fact); keep notes that still matter and drop resolved ones."
+        )
+
+    def apply_compaction(self, response_text, through_turn):
+        """Update from the model's reply; falls back to plain text if it isn't JSON"""
+        match = re.search(r"\{.*\}", response_text, re.DOTALL)
+        try:
+            data = json.loads(match.group(0)) if match else None
+        except ValueError:
+            data = None
+
+        if isinstance(data, dict):
+            self.summary = str(data.get("summary", self.summary)).strip()
+            for kind in NOTE_KINDS:
+                if isinstance(data.get(kind), list):
+                    self.notes[kind] = [str(note) for note in data[kind]][:MAX_NOTES_PER_KIND]
+        else:
+            self.summary = response_text.strip()
+        self.through_turn = through_turn
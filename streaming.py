@@ -0,0 +1,88 @@
+"""Progressive Discord message edits for streamed Gemini responses."""
+import asyncio
+import time
+
+from executors import get_executor
+
+_DONE = object()
+
+
+async def stream_chunks(send_message, *args, runner=None, **kwargs):
+    """Yield text chunks from a streaming Gemini call without blocking the loop
+
+    `send_message` is called with stream=True through `runner` (the LLM
+    executor by default, or an LLMGateway runner); chunks are handed back to
+    the event loop as they arrive.
+    """
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def produce():
+        try:
+            for chunk in send_message(*args, stream=True, **kwargs):
+                loop.call_soon_threadsafe(queue.put_nowait, chunk.text)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            loop.call_soon_threadsafe(queue.put_nowait, _DONE)
+
+    runner = runner or get_executor("llm").run
+    producer = asyncio.create_task(runner(produce))
+    while True:
+        item = await queue.get()
+        if item is _DONE:
+            break
+        if isinstance(item, Exception):
+            raise item
+        yield item
+    await producer
+
+
+class StreamingMessage:
+    """Shows a growing response by editing Discord messages at a throttled pace
+
+    Edits happen at most once per `edit_interval` seconds to stay inside
+    Discord's edit rate limits. Text past `max_length` spills into follow-up
+    messages sent with `send`, split by `split_text`.
+    """
+
+    def __init__(self, first_message, send, split_text, prefix="", continuation="",
+                 edit_interval=1.5, max_length=1900):
+        self.messages = [first_message]
+        self.rendered = [None]
+        self.send = send
+        self.split_text = split_text
+        self.prefix = prefix
+        self.continuation = continuation
+        self.edit_interval = edit_interval
+        self.max_length = max_length
+        self.text = ""
+        self.last_render = 0.0
+
+    async def append(self, chunk):
+        self.text += chunk
+        if time.monotonic() - self.last_render >= self.edit_interval:
+            await self.render(self.text + " ▌")
+
+    async def finish(self, final_text=None):
+        """Render the complete text, e.g. after post-processing"""
+        if final_text is not None:
+            self.text = final_text
+        await self.render(self.text)
+
+    async def render(self, text):
+        chunks = self.split_text(text, self.max_length) if text.strip() else ["▌"]
+        for i, chunk in enumerate(chunks):
+            content = (self.prefix if i == 0 else self.continuation) + chunk
+            if i < len(self.messages):
+                if self.rendered[i] != content:
+                    await self.messages[i].edit(content=content)
+            else:
+                self.messages.append(await self.send(content))
+                self.rendered.append(None)
+            self.rendered[i] = content
+        # Post-processing can shorten the text; drop messages no longer needed
+        while len(self.messages) > len(chunks):
+            await self.messages.pop().delete()
+            self.rendered.pop()
+        self.last_render = time.monotonic()
@@ -0,0 +1,99 @@
+"""Semantic recall of earlier !ask exchanges.
+
+Each conversation keeps a small NumPy index of embedded question/answer
+pairs. For a new question only the few most similar older exchanges are sent
+to Gemini, next to the recent window, so prompt size stays flat however long
+the conversation gets.
+
+The embedding function is pluggable; the default hashes words into a fixed
+number of buckets, which runs locally with no model calls.
+"""
+import base64
+import hashlib
+import re
+
+import numpy as np
+
+DEFAULT_DIMENSIONS = 256
+# Each stored exchange is trimmed to this many characters
+MAX_EXCHANGE_CHARS = 500
+
+
+def hash_embedding(text, dimensions=DEFAULT_DIMENSIONS):
+    """Bag-of-words vector built with the hashing trick, L2-normalized"""
+    vector = np.zeros(dimensions, dtype=np.float32)
+    for word in re.findall(r"\w+", text.lower()):
+        digest = hashlib.blake2b(word.encode("utf-8"), digest_size=8).digest()
+        bucket = int.from_bytes(digest[:4], "little") % dimensions
+        vector[bucket] += 1.0 if digest[4] & 1 else -1.0
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm else vector
+
+
+class VectorMemory:
+    """Capped index of embedded exchanges, oldest first"""
+
+    def __init__(self, embed=hash_embedding, max_items=100):
+        self.embed = embed
+        self.max_items = max_items
+        self.vectors = None  # (n, dimensions) float32, rows L2-normalized
+        self.exchanges = []  # [question, answer] per row
+
+    def __len__(self):
+        return len(self.exchanges)
+
+    def add(self, question, answer):
+        """Index one exchange; returns it as a stored entry (see `encode_entry`)"""
+        question, answer = question[:MAX_EXCHANGE_CHARS], answer[:MAX_EXCHANGE_CHARS]
+        vector = self._normalize(self.embed(f"{question}\n{answer}"))
+        self._append(question, answer, vector)
+        return self.encode_entry(question, answer, vector)
+
+    def _append(self, question, answer, vector):
+        if self.vectors is None or self.vectors.shape[1] != vector.shape[0]:
+            self.vectors = np.empty((0, vector.shape[0]), dtype=np.float32)
+            self.exchanges = []
+        self.vectors = np.vstack([self.vectors, vector])[-self.max_items:]
+        self.exchanges.append([question, answer])
+        self.exchanges = self.exchanges[-self.max_items:]
+
+    def search(self, query, k=3, skip_recent=0, min_score=0.2):
+        """Up to `k` (question, answer) pairs most similar to `query`, best first
+
+        The newest `skip_recent` exchanges are left out because they are
+        already part of the chat history.
+        """
+        candidates = len(self.exchanges) - skip_recent
+        if candidates <= 0 or k <= 0:
+            return []
+        query_vector = self._normalize(self.embed(query))
+        if query_vector.shape[0] != self.vectors.shape[1]:
+            return []
+        scores = self.vectors[:candidates] @ query_vector
+        top = np.argsort(scores)[::-1][:k]
+        return [tuple(self.exchanges[i]) for i in top if scores[i] >= min_score]
+
+    @staticmethod
+    def encode_entry(question, answer, vector):
+        """One exchange as stored, so the index grows by appending a small entry"""
+        # float16 halves the stored size; the precision loss doesn't matter for ranking
+        return {
+            "q": question,
+            "a": answer,
+            "v": base64.b64encode(np.asarray(vector, dtype=np.float16).tobytes()).decode("ascii")
+        }
+
+    @classmethod
+    def from_entries(cls, entries, embed=hash_embedding, max_items=100):
+        """Rebuild an index from stored entries, oldest first"""
+        memory = cls(embed, max_items)
+        for entry in (entries or [])[-max_items:]:
+            vector = np.frombuffer(base64.b64decode(entry["v"]), dtype=np.float16).astype(np.float32)
+            memory._append(entry["q"], entry["a"], vector)
+        return memory
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector